@@ -4,6 +4,6 @@ setup(
     name="nni_amlt",
     description="Amulet toolkit extension of NNI.",
     version="0.1",
-    install_requires=["requests", "pysrt"],
+    install_requires=["requests", "pysrt", "numpy"],
     packages=["whispermovie"],
 )
@@ -0,0 +1,309 @@
+import json
+import subprocess
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from .utils import atomic_output, atomic_write_text, get_logger
+
+_logger = get_logger()
+
+
+def iter_pcm_frames(audio_path: Path, sample_rate: int, frame_length: int,
+                    frames_per_chunk: int = 4096) -> Iterator[np.ndarray]:
+    """Decode an audio file into mono 16-bit PCM and yield it frame by frame.
+
+    The audio is decoded once by ffmpeg and streamed through a pipe,
+    so that the memory usage doesn't grow with the duration of the audio.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        sample_rate (int): Sample rate to decode the audio at.
+        frame_length (int): Number of samples in each frame.
+        frames_per_chunk (int): Number of frames read from ffmpeg at a time.
+
+    Yields:
+        np.ndarray: Array of shape (num_frames, frame_length). The trailing incomplete frame is dropped.
+    """
+    process = subprocess.Popen(["ffmpeg", "-v", "error", "-i", str(audio_path), "-map", "0:a:0",
+                                "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"],
+                               stdout=subprocess.PIPE)
+    assert process.stdout is not None
+    chunk_bytes = frame_length * frames_per_chunk * 2
+    remainder = b""
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            data = remainder + data
+            num_frames = len(data) // (frame_length * 2)
+            remainder = data[num_frames * frame_length * 2:]
+            if num_frames > 0:
+                yield np.frombuffer(data, dtype=np.int16, count=num_frames * frame_length).reshape(-1, frame_length)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, "ffmpeg")
+
+
+def frame_energy(audio_path: Path, sample_rate: int = 8000, frame_duration: float = 0.02) -> np.ndarray:
+    """Compute the energy (in dB) of every frame of an audio file.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        sample_rate (int): Sample rate to analyze the audio at. Low rates are enough for detecting silence.
+        frame_duration (float): Duration of each frame in seconds.
+
+    Returns:
+        np.ndarray: 1-D array of frame energies.
+    """
+    _logger.info("Analyzing energy of audio file %s", audio_path)
+    frame_length = int(sample_rate * frame_duration)
+    chunks: List[np.ndarray] = []
+    for frames in iter_pcm_frames(audio_path, sample_rate, frame_length):
+        power = np.mean(np.square(frames.astype(np.float32) / 32768.), axis=1)
+        chunks.append(10. * np.log10(power + 1e-10))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+def find_quiet_point(energy: np.ndarray, frame_duration: float, lower: float, upper: float,
+                     quiet_window: float = 0.5) -> float:
+    """Find the middle of the quietest window within a time range.
+
+    Args:
+        energy (np.ndarray): Frame energies computed by :func:`frame_energy`.
+        frame_duration (float): Duration of each frame in seconds.
+        lower (float): Start of the time range to search in seconds.
+        upper (float): End of the time range to search in seconds.
+        quiet_window (float): Length of the window whose average energy is minimized, in seconds.
+
+    Returns:
+        float: The time of the quiet point in seconds. ``upper`` if the range contains no complete window.
+    """
+    window = max(int(round(quiet_window / frame_duration)), 1)
+    lower_frame = max(int(lower / frame_duration), 0)
+    upper_frame = min(int(upper / frame_duration), len(energy))
+    if upper_frame - lower_frame < window:
+        return upper
+    # Moving average of energy over the window.
+    cumsum = np.cumsum(np.concatenate([[0.], energy[lower_frame:upper_frame].astype(np.float64)]))
+    averages = (cumsum[window:] - cumsum[:-window]) / window
+    # Take the latest one among the quietest windows, so that segments are as long as possible.
+    best = len(averages) - 1 - int(np.argmin(averages[::-1]))
+    return (lower_frame + best + window / 2) * frame_duration
+
+
+def find_split_points(energy: np.ndarray, frame_duration: float, duration: float,
+                      step: float, search_window: float, quiet_window: float = 0.5) -> List[float]:
+    """Find split points on silence.
+
+    Each split point is the quietest point in the ``search_window`` seconds before its nominal position,
+    which is ``step`` seconds after the previous split point.
+
+    Args:
+        energy (np.ndarray): Frame energies computed by :func:`frame_energy`.
+        frame_duration (float): Duration of each frame in seconds.
+        duration (float): Duration of the audio in seconds.
+        step (float): Maximum distance between consecutive split points in seconds.
+        search_window (float): Length of the range searched before each nominal split point, in seconds.
+        quiet_window (float): Length of the window whose average energy is minimized, in seconds.
+
+    Returns:
+        List[float]: Split points in seconds, rounded to milliseconds. Doesn't include 0 and the end of the audio.
+    """
+    search_window = min(search_window, step / 2)
+    points: List[float] = []
+    previous = 0.
+    while previous + step + 1 < duration:
+        nominal = previous + step
+        point = round(find_quiet_point(energy, frame_duration, nominal - search_window, nominal, quiet_window), 3)
+        _logger.info("Split point on silence: %.3f (nominal: %.3f)", point, nominal)
+        points.append(point)
+        previous = point
+    return points
+
+
+def speech_density(energy: np.ndarray, frame_duration: float, ranges: List[Tuple[float, float]],
+                   energy_margin: float = 10.) -> List[float]:
+    """Fraction of loud (likely voiced) frames in each time range.
+
+    Args:
+        energy (np.ndarray): Frame energies computed by :func:`frame_energy`.
+        frame_duration (float): Duration of each frame in seconds.
+        ranges (List[Tuple[float, float]]): Time ranges in seconds.
+        energy_margin (float): How much (in dB) a frame must be louder than the noise floor to be counted.
+
+    Returns:
+        List[float]: Fraction between 0 and 1 for each range.
+    """
+    if len(energy) == 0:
+        return [0. for _ in ranges]
+    loud = energy > np.percentile(energy, 10) + energy_margin
+    cumsum = np.concatenate([[0], np.cumsum(loud)])
+    densities: List[float] = []
+    for start, end in ranges:
+        lower = min(max(int(start / frame_duration), 0), len(energy))
+        upper = min(max(int(end / frame_duration), lower), len(energy))
+        densities.append(float(cumsum[upper] - cumsum[lower]) / max(upper - lower, 1))
+    return densities
+
+
+def detect_speech(audio_path: Path, sample_rate: int = 16000, frame_duration: float = 0.02,
+                  min_gap: float = 2., padding: float = 0.3, min_speech: float = 0.1,
+                  energy_margin: float = 10., flatness_threshold: float = 0.45) -> List[Tuple[float, float]]:
+    """Detect the time ranges containing speech with energy and spectral flatness.
+
+    A frame is considered to be speech when it's loud enough compared to the noise floor,
+    and its spectrum in the speech band is not flat (noise-like).
+    Short pauses between words are bridged, so that only long non-speech spans are excluded.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        sample_rate (int): Sample rate to analyze the audio at.
+        frame_duration (float): Duration of each frame in seconds.
+        min_gap (float): Non-speech spans shorter than this (in seconds) are kept as part of speech.
+        padding (float): Seconds added before and after every speech range.
+        min_speech (float): Speech ranges shorter than this (in seconds) are ignored.
+        energy_margin (float): How much (in dB) a speech frame must be louder than the noise floor.
+        flatness_threshold (float): Maximum spectral flatness of a speech frame.
+
+    Returns:
+        List[Tuple[float, float]]: Sorted, non-overlapping speech ranges in seconds.
+    """
+    _logger.info("Detecting speech in audio file %s", audio_path)
+    frame_length = int(sample_rate * frame_duration)
+    window = np.hanning(frame_length).astype(np.float32)
+    frequencies = np.fft.rfftfreq(frame_length, 1. / sample_rate)
+    band = (frequencies >= 300) & (frequencies <= 4000)
+
+    energies: List[np.ndarray] = []
+    flatnesses: List[np.ndarray] = []
+    for frames in iter_pcm_frames(audio_path, sample_rate, frame_length):
+        frames = frames.astype(np.float32) / 32768.
+        power = np.mean(np.square(frames), axis=1)
+        energies.append(10. * np.log10(power + 1e-10))
+        spectrum = np.square(np.abs(np.fft.rfft(frames * window, axis=1)[:, band])) + 1e-12
+        flatnesses.append(np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1))
+    if not energies:
+        return []
+    energy = np.concatenate(energies)
+    flatness = np.concatenate(flatnesses)
+
+    noise_floor = np.percentile(energy, 10)
+    is_speech = (energy > noise_floor + energy_margin) & (flatness < flatness_threshold)
+
+    # Boundaries of consecutive speech frames.
+    changes = np.diff(np.concatenate([[0], is_speech.astype(np.int8), [0]]))
+    starts = np.flatnonzero(changes == 1)
+    ends = np.flatnonzero(changes == -1)
+    if len(starts) == 0:
+        return []
+
+    # Bridge short gaps, then drop short blips.
+    keep = (starts[1:] - ends[:-1]) >= int(min_gap / frame_duration)
+    starts = starts[np.concatenate([[True], keep])]
+    ends = ends[np.concatenate([keep, [True]])]
+    long_enough = (ends - starts) >= int(min_speech / frame_duration)
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    duration = len(energy) * frame_duration
+    regions: List[Tuple[float, float]] = []
+    for start, end in zip(starts * frame_duration - padding, ends * frame_duration + padding):
+        start, end = round(max(float(start), 0.), 3), round(min(float(end), duration), 3)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    speech_duration = sum(end - start for start, end in regions)
+    _logger.info("Detected %d speech ranges, %.1f seconds of %.1f seconds in total",
+                 len(regions), speech_duration, duration)
+    return regions
+
+
+def extract_regions(audio_path: Path, regions: List[Tuple[float, float]], output_path: Path,
+                    sample_rate: int = 16000) -> None:
+    """Concatenate some time ranges of an audio file into a new mono FLAC file.
+
+    Cutting is done on decoded samples, so the result is sample-accurate and consistent with :class:`TimeMap`.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        regions (List[Tuple[float, float]]): Sorted, non-overlapping time ranges to keep, in seconds.
+        output_path (Path): Path to the output file.
+        sample_rate (int): Sample rate of the output.
+    """
+    _logger.info("Extracting %d ranges of audio file %s to %s", len(regions), audio_path, output_path)
+    starts = np.array([int(round(start * sample_rate)) for start, _ in regions], dtype=np.int64)
+    ends = np.array([int(round(end * sample_rate)) for _, end in regions], dtype=np.int64)
+    with atomic_output(output_path) as temporary_path:
+        encoder = subprocess.Popen(["ffmpeg", "-v", "error", "-y", "-f", "s16le", "-ac", "1", "-ar", str(sample_rate),
+                                    "-i", "-", "-c:a", "flac", "-f", "flac", str(temporary_path)],
+                                   stdin=subprocess.PIPE)
+        assert encoder.stdin is not None
+        offset = 0
+        try:
+            frame_length = sample_rate // 100
+            for frames in iter_pcm_frames(audio_path, sample_rate, frame_length):
+                samples = frames.reshape(-1)
+                indices = np.arange(offset, offset + len(samples))
+                region = np.searchsorted(starts, indices, side="right") - 1
+                selected = (region >= 0) & (indices < ends[np.maximum(region, 0)])
+                encoder.stdin.write(samples[selected].tobytes())
+                offset += len(samples)
+        finally:
+            encoder.stdin.close()
+            returncode = encoder.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, "ffmpeg")
+
+
+class TimeMap:
+    """Mapping from the timeline of an audio with only some ranges kept back to the original timeline.
+
+    Args:
+        regions (List[Tuple[float, float]]): Sorted, non-overlapping time ranges kept, in seconds.
+    """
+
+    def __init__(self, regions: List[Tuple[float, float]]):
+        self.regions = regions
+        self.original_starts = np.array([start for start, _ in regions], dtype=np.float64)
+        self.original_ends = np.array([end for _, end in regions], dtype=np.float64)
+        lengths = np.array([end - start for start, end in regions], dtype=np.float64)
+        self.starts = np.concatenate([[0.], np.cumsum(lengths)[:-1]]) if regions else np.zeros(0)
+
+    def to_original(self, times: np.ndarray) -> np.ndarray:
+        """Map times (in seconds) on the kept timeline to the original timeline."""
+        times = np.asarray(times, dtype=np.float64)
+        if len(self.starts) == 0:
+            return times
+        index = self._region_of(times)
+        return self.original_starts[index] + (times - self.starts[index])
+
+    def range_to_original(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Map time ranges (in seconds) on the kept timeline to the original timeline.
+
+        Each end is kept within the region its start falls in, so that a range ending just after a join
+        does not stretch over the removed part that follows the region.
+        """
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        if len(self.starts) == 0:
+            return starts, ends
+        original_starts = self.to_original(starts)
+        region_ends = self.original_ends[self._region_of(starts)]
+        return original_starts, np.maximum(np.minimum(self.to_original(ends), region_ends), original_starts)
+
+    def _region_of(self, times: np.ndarray) -> np.ndarray:
+        return np.maximum(np.searchsorted(self.starts, times, side="right") - 1, 0)
+
+    def save(self, path: Path) -> None:
+        atomic_write_text(path, json.dumps(self.regions))
+
+    @classmethod
+    def load(cls, path: Path) -> "TimeMap":
+        return cls([(start, end) for start, end in json.loads(path.read_text())])
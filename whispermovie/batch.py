@@ -0,0 +1,93 @@
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+from .core import Job, add_process_arguments, options_from_arguments, run_jobs
+from .utils import get_logger
+
+_logger = get_logger()
+
+MEDIA_SUFFIXES = {
+    ".aac", ".avi", ".flac", ".flv", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4",
+    ".mpeg", ".mpg", ".ogg", ".opus", ".ts", ".wav", ".webm", ".wma", ".wmv",
+}
+
+
+def collect_inputs(inputs: List[str], manifest: Optional[str] = None) -> List[Path]:
+    """Expand the inputs of a batch into a list of media files.
+
+    Args:
+        inputs (List[str]): Media files, or directories whose media files (recursively) are all included.
+            Files in ``*.progress`` directories (left by earlier runs) are skipped.
+        manifest (str, optional): A text file listing one media file per line. Empty lines and lines
+            starting with ``#`` are ignored. Relative paths are relative to the manifest.
+
+    Returns:
+        List[Path]: Media files, without duplicates, in the order they are given.
+    """
+    paths: List[Path] = []
+    for input_ in inputs:
+        path = Path(input_)
+        if path.is_dir():
+            # Progress directories of earlier runs hold intermediate audios, which are not inputs.
+            paths.extend(sorted(p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in MEDIA_SUFFIXES
+                                and not any(part.endswith(".progress") for part in p.relative_to(path).parts[:-1])))
+        elif path.exists():
+            paths.append(path)
+        else:
+            raise ValueError(f"Input file {path} does not exist.")
+
+    if manifest is not None:
+        manifest_path = Path(manifest)
+        for line in manifest_path.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = Path(line)
+            if not path.is_absolute():
+                path = manifest_path.parent / path
+            if not path.exists():
+                raise ValueError(f"Input file {path} listed in {manifest_path} does not exist.")
+            paths.append(path)
+
+    unique_paths: List[Path] = []
+    seen = set()
+    for path in paths:
+        if path.resolve() not in seen:
+            seen.add(path.resolve())
+            unique_paths.append(path)
+    return unique_paths
+
+
+def main():
+    parser = argparse.ArgumentParser("Translate / transcribe many media files to srt subtitles in one run.")
+    parser.add_argument("inputs", type=str, nargs="*", help="Media files or directories containing media files.")
+    parser.add_argument("--manifest", type=str, default=None, help="A text file listing one media file per line.")
+    parser.add_argument("--mode", type=str, default="translations", choices=["translations", "transcriptions"],
+                        help="Whether to translate (to English) or transcribe.")
+    parser.add_argument("--output-dir", "-o", type=str, default=None,
+                        help="Directory of outputs. A *.progress directory and a *.srt file will be created for each "
+                             "input. By default, they are next to the inputs.")
+    add_process_arguments(parser)
+    args = parser.parse_args()
+
+    options = options_from_arguments(args.mode, args)
+    media_paths = collect_inputs(args.inputs, args.manifest)
+    if not media_paths:
+        raise ValueError("No media file to process.")
+
+    jobs: List[Job] = []
+    for media_path in media_paths:
+        output_directory = Path(args.output_dir) if args.output_dir is not None else media_path.parent
+        progress_directory = output_directory / (media_path.stem + ".progress")
+        output_path = output_directory / (media_path.stem + ".srt")
+        if any(job.output_path == output_path for job in jobs):
+            raise ValueError(f"Multiple inputs would be written to {output_path}.")
+        jobs.append(Job(media_path, progress_directory, output_path))
+    _logger.info("Processing %d media files", len(jobs))
+
+    run_jobs(jobs, options, args)
+
+
+if __name__ == "__main__":
+    main()
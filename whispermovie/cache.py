@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+
+def default_cache_directory() -> Path:
+    """The directory of persistent caches. Follows ``XDG_CACHE_HOME`` if set."""
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if cache_home:
+        return Path(cache_home) / "whispermovie"
+    return Path.home() / ".cache" / "whispermovie"
+
+
+class TranscriptionCache:
+    """Persistent cache of translation / transcription results, shared across runs.
+
+    Results are keyed by the content of the uploaded audio together with all the request parameters
+    affecting the result, so a cached result is never returned for a different request.
+    The cache can be shared by multiple threads.
+
+    Args:
+        directory (Path, optional): Directory to store the cache database. Defaults to :func:`default_cache_directory`.
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        if directory is None:
+            directory = default_cache_directory()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / "transcriptions.sqlite3"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(audio: bytes, mode: str, prompt: str, language: Optional[str],
+                 response_format: str, model: str) -> str:
+        """Compute the cache key of a request.
+
+        Args:
+            audio (bytes): Content of the uploaded audio.
+            mode (str): The mode of the request.
+            prompt (str): The prompt of the request.
+            language (str, optional): The language of the request.
+            response_format (str): The format of the response.
+            model (str): The model of the request.
+
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        hasher = hashlib.sha256(audio)
+        hasher.update(json.dumps([mode, prompt, language, response_format, model]).encode())
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM transcriptions WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key: str, response: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO transcriptions (key, response) VALUES (?, ?)",
+                                     (key, response))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
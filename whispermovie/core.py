@@ -1,17 +1,42 @@
 import argparse
+import difflib
+import io
+import os
+import re
 import subprocess
 import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterator, Tuple, List, Optional, cast
+from typing import Deque, Dict, Iterator, NamedTuple, Tuple, List, Optional, TextIO
 
-import pysrt
+import numpy as np
 
-from .openai import openai_audio
-from .utils import get_logger
+from .analysis import TimeMap, detect_speech, extract_regions, find_split_points, frame_energy, speech_density
+from .cache import TranscriptionCache
+from .cues import Cue, find_degenerate_ranges, load_cues, parse_response, render_srt, render_verbose_json
+from .srt import format_srt, read_srt
+from .journal import CLIPPED, EXTRACTED, MERGED, TRANSCRIBED, Journal
+from .openai import OpenAIClient, get_default_client, load_config, openai_audio
+from .pipeline import Stage, run_pipeline
+from .store import CueStore
+from .tokens import CJK_RANGES
+from .utils import atomic_output, atomic_write_text, get_logger, partial_path
 
 _logger = get_logger()
 
 
+class Segment(NamedTuple):
+    """A time range of the audio that is translated / transcribed with one request."""
+    start: float
+    end: float
+    audio_path: Path
+    subtitle_path: Path
+    speed: float = 1.
+
+
 def get_duration(media_path: Path) -> float:
     """Get the duration of a media file.
 
@@ -28,120 +53,840 @@ def get_duration(media_path: Path) -> float:
     return float(result.decode())
 
 
-def clip_audio(audio_path: Path, start: int, end: int, output_path: Path) -> None:
+def extract_audio(media_path: Path, output_path: Path) -> None:
+    """Extract the audio track of a media file into a compact intermediate.
+
+    The intermediate is mono 16 kHz FLAC, which is what Whisper works with internally,
+    so nothing useful for recognition is lost. It is much smaller and faster to demux than
+    the original container (which usually contains video as well).
+
+    Args:
+        media_path (Path): Path to the media file.
+        output_path (Path): Path to the extracted audio file.
+    """
+    _logger.info("Extracting audio track of %s to %s", media_path, output_path)
+    # Write to a temporary file first, so that an interrupted extraction is never reused.
+    with atomic_output(output_path) as temporary_path:
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", str(media_path), "-map", "0:a:0",
+                        "-ac", "1", "-ar", "16000", "-c:a", "flac", "-f", "flac", str(temporary_path)], check=True)
+    _logger.info("Audio track saved: %s", output_path)
+
+
+class UploadProfile(NamedTuple):
+    """Encoding of the audio segments uploaded to OpenAI."""
+    suffix: str
+    format: str
+    codec: str
+    bitrate: int
+    channels: Optional[int] = 1
+    sample_rate: Optional[int] = 16000
+
+    def ffmpeg_args(self, bitrate: Optional[int] = None) -> List[str]:
+        """Output options of ffmpeg. Bitrate (in kbps) can be overridden."""
+        args = ["-c:a", self.codec, "-b:a", f"{bitrate or self.bitrate}k"]
+        if self.channels is not None:
+            args += ["-ac", str(self.channels)]
+        if self.sample_rate is not None:
+            args += ["-ar", str(self.sample_rate)]
+        return args + ["-f", self.format]
+
+    def max_duration(self, max_bytes: int) -> float:
+        """Longest duration (in seconds) whose encoding is expected to fit in max_bytes, with a 5% margin."""
+        return max_bytes * 8 / (self.bitrate * 1000) * 0.95
+
+
+# Speech recognition needs much less than music. Mono 16 kHz is what Whisper works with internally.
+UPLOAD_PROFILES = {
+    "mp3-192k": UploadProfile("mp3", "mp3", "libmp3lame", 192, channels=None, sample_rate=None),
+    "mp3-48k": UploadProfile("mp3", "mp3", "libmp3lame", 48),
+    "opus-32k": UploadProfile("ogg", "ogg", "libopus", 32),
+    "opus-24k": UploadProfile("ogg", "ogg", "libopus", 24),
+}
+
+DEFAULT_UPLOAD_PROFILE = "mp3-48k"
+
+# Maximum size of files accepted by OpenAI audio API.
+MAX_UPLOAD_BYTES = 25 * 1000 * 1000
+
+# Lowest bitrate (in kbps) tried when a segment is too large.
+_MIN_BITRATE = 16
+
+
+def clip_audio(audio_path: Path, start: float, end: float, output_path: Optional[Path],
+               profile: UploadProfile = UPLOAD_PROFILES[DEFAULT_UPLOAD_PROFILE],
+               max_bytes: int = MAX_UPLOAD_BYTES, speed: float = 1.) -> Optional[bytes]:
     """Clip an audio file.
 
+    If the clip is larger than max_bytes, it's encoded again at a lower bitrate.
+    If speed is not 1, the clip is played faster (with pitch preserved), so that it's shorter to upload and process.
+
     Args:
         audio_path (Path): Path to the audio file to clip.
-        start (int): Start time in seconds.
-        end (int): End time in seconds.
-        output_path (Path): Path to the output file.
+        start (float): Start time in seconds.
+        end (float): End time in seconds.
+        output_path (Path, optional): Path to the output file.
+            If None, the clip is streamed from ffmpeg into memory and returned, without touching the disk.
+        profile (UploadProfile): Encoding of the output.
+        max_bytes (int): Maximum size of the output file.
+        speed (float): Playback speed of the output.
+
+    Returns:
+        bytes, optional: The encoded clip if output_path is None.
     """
-    _logger.info("Clipping audio file %s from %d to %d and saving to %s",
-                 audio_path, start, end, output_path)
-    subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", str(audio_path), "-ss", str(start), "-to",
-                    str(end), "-ab", "192k", "-f", "mp3", str(output_path)], check=True)
-    _logger.info("Audio segment saved: %s", output_path)
+    _logger.info("Clipping audio file %s from %s to %s and saving to %s",
+                 audio_path, start, end, output_path if output_path is not None else "memory")
+    if output_path is None:
+        return _encode_clip(audio_path, start, end, None, profile, max_bytes, speed)
+    with atomic_output(output_path) as temporary_path:
+        _encode_clip(audio_path, start, end, temporary_path, profile, max_bytes, speed)
+    _logger.info("Audio segment saved: %s (%d KB)", output_path, output_path.stat().st_size // 1024)
+    return None
 
 
-def segment_audio(audio_path: Path, output_directory: Path,
-                  segment_length: int, overlap: int, reuse: bool) -> Iterator[Tuple[Path, int, int]]:
-    """Segment an audio file into segments of length segment_length with overlap overlap.
+def _encode_clip(audio_path: Path, start: float, end: float, output_path: Optional[Path],
+                 profile: UploadProfile, max_bytes: int, speed: float) -> Optional[bytes]:
+    filters = [] if speed == 1. else ["-af", f"atempo={speed}"]
+    bitrate = profile.bitrate
+    # Named by its range, as output_path is a temporary file, or None if the clip is kept in memory.
+    name = f"{start:g} - {end:g} of {audio_path}"
+    while True:
+        # Seeking on the input side jumps to the start directly instead of decoding from the beginning.
+        # The duration is also limited on the input side, so that it counts source audio rather than sped-up output.
+        command = ["ffmpeg", "-v", "error", "-y", "-ss", str(start), "-t", str(end - start), "-i", str(audio_path),
+                   "-map", "0:a:0"] + filters + profile.ffmpeg_args(bitrate)
+        if output_path is None:
+            data: Optional[bytes] = subprocess.run(command + ["pipe:1"], stdout=subprocess.PIPE, check=True).stdout
+            size = len(data)
+        else:
+            data = None
+            subprocess.run(command + [str(output_path)], check=True)
+            size = output_path.stat().st_size
+        if size <= max_bytes:
+            break
+        if bitrate <= _MIN_BITRATE:
+            raise RuntimeError(f"Audio segment {name} is too large ({size} bytes) even at {bitrate} kbps. "
+                               "Please use a shorter segment.")
+        bitrate = max(_MIN_BITRATE, int(bitrate * max_bytes / size * 0.9))
+        _logger.warning("Audio segment %s is too large (%d bytes). Encoding again at %d kbps.",
+                        name, size, bitrate)
+    return data
+
+
+def plan_segments(duration: float, segment_length: int, overlap: int,
+                  split_points: Optional[List[float]] = None) -> List[Tuple[float, float]]:
+    """Compute the time ranges of segments of length segment_length with overlap overlap.
 
     Args:
-        audio_path (Path): Path to the audio file to segment.
+        duration (float): Duration of the audio in seconds.
         segment_length (int): Length of each segment in seconds.
         overlap (int): Length of overlap between segments in seconds.
-        reuse (bool): Whether to reuse existing segments.
+        split_points (List[float], optional): Where to split the audio, e.g., points on silence.
+            If given, the overlap is centered on each split point. Otherwise, the audio is split at fixed intervals.
+
+    Returns:
+        List[Tuple[float, float]]: Start and end time (in seconds) of each segment.
     """
-    _logger.info("Segmenting audio file %s into segments of length %d with overlap %d",
-                 audio_path, segment_length, overlap)
+    segments: List[Tuple[float, float]] = []
+    if split_points is not None:
+        bounds = [0.] + split_points + [duration]
+        for i in range(len(bounds) - 1):
+            start = 0 if i == 0 else bounds[i] - overlap / 2
+            end = int(duration + 1) if i == len(bounds) - 2 else bounds[i + 1] + overlap / 2
+            segments.append((start, end))
+        return segments
 
-    duration = get_duration(audio_path)
-    _logger.info("Duration of audio file: %f seconds", duration)
     start = 0
     while start < duration:
         end = start + segment_length
         if end + 1 > duration:
             # Last 1 second.
             end = int(duration + 1)  # Add 1 to be safe.
-        output_path = output_directory / f"{start:05d}-{end:05d}.mp3"
-        if reuse and output_path.exists():
-            _logger.info('Reuse generated audio: %s', output_path)
-        else:
-            clip_audio(audio_path, start, end, output_path)
-        yield output_path, start, end
+        segments.append((start, end))
         if end >= duration:
             break
         start += segment_length - overlap
+    return segments
 
 
-def merge_subtitles(subtitle_segments: List[Tuple[Path, int, int]], output_path: Path, delete_duplicates: int) -> None:
-    """Merge subtitles into a single file.
+def segment_stem(start: float, end: float, speed: float = 1.) -> str:
+    """File name (without suffix) of the segment in the progress directory."""
+    def format_time(seconds: float) -> str:
+        if float(seconds).is_integer():
+            return f"{int(seconds):05d}"
+        return f"{seconds:09.3f}"
+
+    stem = f"{format_time(start)}-{format_time(end)}"
+    if speed != 1.:
+        stem += f"-x{speed:g}"
+    return stem
+
+
+def probe_segments(audio_path: Path, output_directory: Path,
+                   segment_length: int, overlap: int,
+                   split_on_silence: bool = False, silence_search: float = 30.,
+                   audio_suffix: str = "mp3", speedup: float = 1.,
+                   speedup_density: Optional[float] = None, subtitle_suffix: str = "srt") -> Iterator[Segment]:
+    """Plan the segments of an audio file without clipping them.
+
+    Args:
+        audio_path (Path): Path to the audio file to segment.
+        output_directory (Path): Directory where the segment audios and subtitles will be saved.
+        segment_length (int): Length of each segment in seconds.
+        overlap (int): Length of overlap between segments in seconds.
+        split_on_silence (bool): Whether to split the audio at the quietest point near each nominal split point.
+        silence_search (float): Length of the range (in seconds) searched for silence before each nominal split point.
+        audio_suffix (str): Suffix of the segment audio files.
+        speedup (float): Playback speed of the uploaded segments.
+        speedup_density (float, optional): If set, only segments whose fraction of voiced frames is below this
+            are sped up, i.e., where speech is sparse. Otherwise, all the segments are sped up.
+        subtitle_suffix (str): Suffix of the segment subtitle files, i.e., "srt" or "json" (verbose_json).
+    """
+    duration = get_duration(audio_path)
+    _logger.info("Duration of audio file: %f seconds", duration)
+    frame_duration = 0.02
+    energy = None
+    if split_on_silence or (speedup != 1. and speedup_density is not None):
+        energy = frame_energy(audio_path, frame_duration=frame_duration)
+    split_points: Optional[List[float]] = None
+    if split_on_silence:
+        assert energy is not None
+        split_points = find_split_points(energy, frame_duration, duration, segment_length - overlap, silence_search)
+
+    ranges = plan_segments(duration, segment_length, overlap, split_points)
+    speeds = [speedup] * len(ranges)
+    if speedup != 1. and speedup_density is not None:
+        assert energy is not None
+        densities = speech_density(energy, frame_duration, ranges)
+        speeds = [speedup if density < speedup_density else 1. for density in densities]
+        _logger.info("Speech density of segments: %s", ", ".join(f"{density:.2f}" for density in densities))
+
+    for (start, end), speed in zip(ranges, speeds):
+        stem = segment_stem(start, end, speed)
+        yield Segment(start, end, output_directory / f"{stem}.{audio_suffix}",
+                      output_directory / f"{stem}.{subtitle_suffix}", speed)
+
+
+# A word, or a single CJK character (CJK text has no spaces between words).
+_WORD_PATTERN = re.compile(f"[{CJK_RANGES}]|[^\\W{CJK_RANGES}]+")
+
+
+def find_splice(previous: CueStore, following: CueStore,
+                overlap_start: float, overlap_end: float, min_match: int = 3) -> Optional[Tuple[int, int]]:
+    """Find where to splice the subtitles of two neighboring segments by aligning their text in the overlap.
+
+    Words of the cues in the overlap are aligned as two token sequences. The splice is placed in the longest run
+    of words both segments agree on, preferably at a word ending a cue in both segments, so that no cue is cut.
+
+    Args:
+        previous (CueStore): Cues of the earlier segment, on the timeline of the whole audio.
+        following (CueStore): Cues of the later segment, on the timeline of the whole audio.
+        overlap_start (float): Start of the overlap in seconds.
+        overlap_end (float): End of the overlap in seconds.
+        min_match (int): Minimum number of consecutive words to agree on.
+
+    Returns:
+        Optional[Tuple[int, int]]: Index of the last cue kept from previous, and of the last cue dropped from following.
+        None if the segments don't agree on enough words.
+    """
+    def tokenize(cues: CueStore, indices: np.ndarray) -> Tuple[List[str], List[int], List[bool]]:
+        words: List[str] = []
+        owners: List[int] = []  # Index of the cue each word belongs to.
+        cue_ends: List[bool] = []  # Whether each word is the last one of its cue.
+        for index in indices.tolist():
+            tokens = _WORD_PATTERN.findall(cues.text_of(index).lower())
+            words.extend(tokens)
+            owners.extend([index] * len(tokens))
+            cue_ends.extend(n == len(tokens) - 1 for n in range(len(tokens)))
+        return words, owners, cue_ends
+
+    previous_words, previous_owners, previous_ends = tokenize(
+        previous, np.flatnonzero(previous.ends > overlap_start * 1000))
+    following_words, following_owners, following_ends = tokenize(
+        following, np.flatnonzero(following.starts < overlap_end * 1000))
+
+    matcher = difflib.SequenceMatcher(None, previous_words, following_words, autojunk=False)
+    block = max(matcher.get_matching_blocks(), key=lambda block: block.size)
+    if block.size < min_match:
+        return None
+    splice = block.size - 1
+    for n in reversed(range(block.size)):
+        if previous_ends[block.a + n] and following_ends[block.b + n]:
+            splice = n
+            break
+    return previous_owners[block.a + splice], following_owners[block.b + splice]
+
+
+class SubtitleMerger:
+    """Merges the subtitles of consecutive segments into a srt file incrementally.
+
+    Segments can be added in any order. Once a segment and the next one are both added, the cues of the segment
+    are settled (see :func:`merge_subtitles` for how overlaps are resolved) and appended to the output,
+    so that only a few segments are held in memory at any time.
+    Each append is a whole number of cues followed by fsync, so the output is always a readable srt file.
 
     Args:
-        subtitle_segments (List[Tuple[Path, int, int]]): List of subtitle files to merge.
         output_path (Path): Path to the output file.
         delete_duplicates (int): Number of consecutive duplicate subtitles to delete.
+        time_map (TimeMap, optional): Maps the timeline of the segments back to the original media,
+            when some parts of the media have been removed before segmentation.
+        align_overlap (bool): Whether to splice neighboring segments by aligning the text in their overlap.
+        stream (bool): Whether to append to output_path directly, so that it can be read while the merge goes on.
+            Otherwise, the output is written to a temporary file, which is moved to output_path when closed.
     """
-    merged_subtitles: List[pysrt.SubRipItem] = []
 
-    # The real split position is the middle of current segment end and next segment start.
-    real_segments: List[Tuple[int, int]] = []
-    for i in range(len(subtitle_segments)):
-        if i + 1 == len(subtitle_segments):
-            segment_end = subtitle_segments[i][2]
-        else:
-            segment_end = (subtitle_segments[i][2] + subtitle_segments[i + 1][1]) // 2
+    def __init__(self, output_path: Path, delete_duplicates: int, time_map: Optional[TimeMap] = None,
+                 align_overlap: bool = False, stream: bool = False):
+        self.output_path = output_path
+        self.delete_duplicates = delete_duplicates
+        self.time_map = time_map
+        self.align_overlap = align_overlap
+        self._path = output_path if stream else partial_path(output_path)
+        self._file: Optional[TextIO] = None  # Opened on the first write.
+        self._pending: Dict[int, Tuple[Path, float, float, CueStore]] = {}
+        self._next_index = 0
+        # The last segment added in order, whose cues are not settled until the next segment is added.
+        self._current: Optional[Tuple[Path, float, float, CueStore]] = None
+        # Where the current segment starts to be used: a splice with the previous segment or a time.
+        self._left_splice: Optional[Tuple[int, int]] = None
+        self._valid_start = 0.
+        # Trailing run of identical cues (start and end in milliseconds, text), which might continue into the
+        # next segment.
+        self._run: List[Tuple[int, int, str]] = []
+        self._written = 0
+
+    def add(self, index: int, subtitle_path: Path, start: float, end: float, speed: float = 1.) -> None:
+        """Add the subtitles of a segment.
 
-        if i == 0:
-            segment_start = subtitle_segments[i][1]
+        Args:
+            index (int): Index of the segment, counting from 0.
+            subtitle_path (Path): Subtitle file of the segment, in srt or verbose_json (``*.json``) format.
+            start (float): Start time of the segment in seconds.
+            end (float): End time of the segment in seconds.
+            speed (float): Playback speed of the segment when it was processed.
+        """
+        if subtitle_path.suffix == ".json":
+            cues = load_cues(subtitle_path)
+            hallucinations = [cue for cue in cues if cue.is_hallucination()]
+            if hallucinations:
+                _logger.info("Deleted %d cues of %s that are likely hallucinations: %s", len(hallucinations),
+                             subtitle_path, " / ".join(cue.text for cue in hallucinations))
+                cues = [cue for cue in cues if not cue.is_hallucination()]
+            store = CueStore.from_cues(cues)
         else:
-            segment_start = (subtitle_segments[i][1] + subtitle_segments[i - 1][2]) // 2
-
-        real_segments.append((segment_start, segment_end))
-
-    for (subtitle_path, segment_start, segment_end), (valid_start, valid_end) in zip(subtitle_segments, real_segments):
-        _logger.info("Merging subtitle %s into %s, used segment: %d - %d",
-                     subtitle_path, output_path, valid_start, valid_end)
-        subtitle = pysrt.open(subtitle_path)
-        for sub in subtitle:
-            sub = cast(pysrt.SubRipItem, sub)
-            start_in_seconds = sub.start.ordinal / 1000 + segment_start
-            if not valid_start <= start_in_seconds < valid_end:
-                continue
-            sub.shift(seconds=segment_start)
-            merged_subtitles.append(sub)
-
-    # Delete consecutive duplicate subtitles.
-    merged_subtitles_wo_duplicates: List[pysrt.SubRipItem] = []
-    i, j = 0, 0
-    while i < len(merged_subtitles):
-        j = i + 1
-        while j < len(merged_subtitles) and merged_subtitles[i].text == merged_subtitles[j].text:
-            j += 1
-
-        if j - i >= delete_duplicates:
+            # Srt files carry no confidences, so they are parsed straight into columns.
+            store = CueStore.from_texts(*read_srt(subtitle_path))
+        self._pending[index] = (subtitle_path, start, end, store.retime(speed, start))
+        while self._next_index in self._pending:
+            segment = self._pending.pop(self._next_index)
+            if self._current is None:
+                self._valid_start = segment[1]
+            else:
+                self._settle(segment)
+            self._current = segment
+            self._next_index += 1
+
+    def _settle(self, following: Optional[Tuple[Path, float, float, CueStore]]) -> None:
+        assert self._current is not None
+        subtitle_path, _, end, cues = self._current
+        # Without alignment, the real split position is the middle of current segment end and next segment start.
+        valid_end = end if following is None else (end + following[1]) / 2
+        right_splice: Optional[Tuple[int, int]] = None
+        if following is not None and self.align_overlap:
+            right_splice = find_splice(cues, following[3], following[1], end)
+            if right_splice is None:
+                _logger.info("Subtitles of %s and %s do not agree in their overlap. Split at the middle.",
+                             subtitle_path, following[0])
+        _logger.info("Merging subtitle %s into %s, used segment: %s - %s", subtitle_path, self.output_path,
+                     "aligned" if self._left_splice is not None else self._valid_start,
+                     "aligned" if right_splice is not None else valid_end)
+
+        # Cues are sorted by start time, so the used ones are a contiguous range.
+        lower = self._left_splice[1] + 1 if self._left_splice is not None else \
+            cues.first_starting_from(self._valid_start)
+        upper = right_splice[0] + 1 if right_splice is not None else cues.first_starting_from(valid_end)
+        settled = cues.take(np.arange(lower, max(lower, upper)))
+        self._left_splice, self._valid_start = right_splice, valid_end
+
+        if self.time_map is not None and len(settled):
+            starts, ends = self.time_map.range_to_original(settled.starts / 1000, settled.ends / 1000)
+            settled = CueStore(np.round(starts * 1000), np.round(ends * 1000), settled.text, settled.offsets)
+
+        written: List[Tuple[int, int, str]] = []
+        for cue in zip(settled.starts.tolist(), settled.ends.tolist(), settled.texts()):
+            if self._run and self._run[0][2] != cue[2]:
+                written.extend(self._end_run())
+            self._run.append(cue)
+        if following is None:
+            written.extend(self._end_run())
+        self._append(written)
+
+    def _end_run(self) -> List[Tuple[int, int, str]]:
+        run, self._run = self._run, []
+        if self.delete_duplicates and len(run) >= self.delete_duplicates:
             # More than delete_duplicates subtitles are same. Something must be wrong.
             # Throw away all of them.
-            _logger.info("%d subtitles are same. Deleted: %s", j - i, merged_subtitles[i].text)
-        else:
-            merged_subtitles_wo_duplicates.extend(merged_subtitles[i:j])
+            _logger.info("%d subtitles are same. Deleted: %s", len(run), run[0][2])
+            return []
+        return run
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            self._file = self._path.open("w", encoding="utf-8")
+        return self._file
+
+    def _append(self, cues: List[Tuple[int, int, str]]) -> None:
+        if not cues:
+            return
+        starts, ends, texts = zip(*cues)
+        self._open().write(format_srt(starts, ends, texts, self._written + 1))
+        self._open().flush()
+        os.fsync(self._open().fileno())
+        self._written += len(cues)
+
+    def close(self) -> None:
+        """Settle the last segment and finish the output. All the segments must have been added."""
+        if self._pending:
+            raise RuntimeError(f"Segments {sorted(self._pending)} are added, but some segments before them are not.")
+        if self._current is not None:
+            self._settle(None)
+            self._current = None
+        self._open().close()
+        if self._path != self.output_path:
+            os.replace(self._path, self.output_path)
+        _logger.info("Final results written to: %s", self.output_path)
+
+
+def merge_subtitles(subtitle_segments: List[Tuple[Path, float, float]], output_path: Path, delete_duplicates: int,
+                    time_map: Optional[TimeMap] = None, speeds: Optional[List[float]] = None,
+                    align_overlap: bool = False) -> None:
+    """Merge subtitles into a single file.
+
+    By default, neighboring segments are cut at the middle of their overlap. With align_overlap,
+    they are spliced where their text agrees (see :func:`find_splice`), falling back to the middle
+    if they don't agree anywhere. This loses / duplicates fewer lines, so a much shorter overlap is enough.
+
+    Args:
+        subtitle_segments (List[Tuple[Path, float, float]]): List of subtitle files to merge,
+            in srt or verbose_json (``*.json``) format. Cues of verbose_json which are likely hallucinations are deleted.
+        output_path (Path): Path to the output file.
+        delete_duplicates (int): Number of consecutive duplicate subtitles to delete.
+        time_map (TimeMap, optional): Maps the timeline of the segments back to the original media,
+            when some parts of the media have been removed before segmentation.
+        speeds (List[float], optional): Playback speed of each segment when it was processed.
+            Timestamps in the subtitles are scaled back to real time. Defaults to 1 for all segments.
+        align_overlap (bool): Whether to splice neighboring segments by aligning the text in their overlap.
+    """
+    if speeds is None:
+        speeds = [1.] * len(subtitle_segments)
+    merger = SubtitleMerger(output_path, delete_duplicates, time_map, align_overlap)
+    for index, ((subtitle_path, start, end), speed) in enumerate(zip(subtitle_segments, speeds)):
+        merger.add(index, subtitle_path, start, end, speed)
+    merger.close()
+
+
+def transcribe_segment(mode: str, segment_path: Path, prompt: str,
+                       timeout: float, max_retries: int, language: Optional[str] = None,
+                       client: Optional[OpenAIClient] = None,
+                       cache: Optional[TranscriptionCache] = None, duration: float = 0.,
+                       audio: Optional[bytes] = None, response_format: str = "srt") -> str:
+    """Translate / transcribe one audio segment.
+
+    Args:
+        mode (str): The mode of the request. Can be "translations" or "transcriptions".
+        segment_path (Path): Path to the audio segment. Its name tells OpenAI the format of the audio.
+        prompt (str): Prompt to use for translation / transcription.
+        timeout (float): The timeout for OpenAI requests.
+        max_retries (int): The maximum number of OpenAI request retries.
+        language (str, optional): The language of the transcription. Defaults to None.
+        client (OpenAIClient, optional): The client to send the request with. Defaults to the shared client.
+        cache (TranscriptionCache, optional): Persistent cache consulted before sending the request.
+        duration (float, optional): Duration of the segment in seconds, used for rate limiting.
+        audio (bytes, optional): Content of the audio segment, if it's clipped in memory.
+            Read from segment_path by default.
+        response_format (str, optional): Format of the response, "srt" or "verbose_json". Defaults to "srt".
+
+    Returns:
+        str: The subtitle in response_format.
+    """
+    if client is None:
+        client = get_default_client()
+    if audio is None:
+        audio = segment_path.read_bytes()
 
-        i = j
+    cache_key: Optional[str] = None
+    if cache is not None:
+        cache_key = cache.make_key(audio, mode, prompt, language, response_format, client.config.audio_model)
+        response = cache.get(cache_key)
+        if response is not None:
+            _logger.info("Found cached result of %s", segment_path)
+            return response
 
-    _logger.info("Writing final results to: %s", output_path)
-    pysrt.SubRipFile(merged_subtitles_wo_duplicates).save(output_path)
+    _logger.info("Using whisper to translate / transcribe %s", segment_path)
+    started = time.monotonic()
+    response = openai_audio(io.BytesIO(audio), prompt, mode=mode, language=language,
+                            response_format=response_format, timeout=timeout, max_retries=max_retries,
+                            client=client, duration=duration, filename=segment_path.name)
+    _logger.info("Processed %s (%d KB) in %.1f seconds",
+                 segment_path, len(audio) // 1024, time.monotonic() - started)
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, response)
+    return response
+
+
+# Length (in characters) of the preceding text carried over as the prompt of a re-transcribed range.
+_PROMPT_CARRY_OVER = 400
+
+
+def resplit_segment(mode: str, source_path: Path, segment: Segment, response: str, prompt: str,
+                    timeout: float, max_retries: int, language: Optional[str] = None,
+                    client: Optional[OpenAIClient] = None, cache: Optional[TranscriptionCache] = None,
+                    profile: UploadProfile = UPLOAD_PROFILES[DEFAULT_UPLOAD_PROFILE],
+                    response_format: str = "srt",
+                    max_repeats: int = 3, max_gap: Optional[float] = None,
+                    sub_length: float = 60.) -> str:
+    """Re-transcribe the ranges of a segment where the result is degenerate (see :func:`find_degenerate_ranges`).
+
+    Each degenerate range is split into shorter sub-clips, which are transcribed one by one at normal speed,
+    each prompted with the text preceding it. They are not sent concurrently, as the caller is already one of
+    the concurrent requests of the run. Their cues replace those of the range, and the rest is kept as is.
+
+    Args:
+        mode (str): The mode of the request. Can be "translations" or "transcriptions".
+        source_path (Path): Path to the audio the segment is clipped from.
+        segment (Segment): The segment.
+        response (str): Result of the segment, in response_format.
+        prompt (str): Prompt to use for translation / transcription.
+        timeout (float): The timeout for OpenAI requests.
+        max_retries (int): The maximum number of OpenAI request retries.
+        language (str, optional): The language of the transcription. Defaults to None.
+        client (OpenAIClient, optional): The client to send the requests with. Defaults to the shared client.
+        cache (TranscriptionCache, optional): Persistent cache consulted before sending the requests.
+        profile (UploadProfile): Encoding of the sub-clips.
+        response_format (str): Format of the responses, "srt" or "verbose_json".
+        max_repeats (int): Minimum length of a run of identical cues to be degenerate.
+        max_gap (float, optional): Maximum length (in seconds) of a gap without cues. Gaps are not checked if not set.
+        sub_length (float): Maximum length of the sub-clips in seconds.
+
+    Returns:
+        str: Result of the segment with the degenerate ranges replaced, in response_format.
+    """
+    cues = parse_response(response, response_format)
+    ranges = find_degenerate_ranges(cues, (segment.end - segment.start) / segment.speed, max_repeats, max_gap)
+    if not ranges:
+        return response
+    _logger.warning("Degenerate result of %s in %s. Transcribing them again in shorter clips.",
+                    segment.subtitle_path, ", ".join(f"{start:.1f} - {end:.1f}" for start, end in ranges))
+
+    # Sub-clips on the timeline of the source audio. Ranges are on the (possibly sped up) timeline of the segment.
+    sub_clips: List[Tuple[float, float]] = []
+    for start, end in ranges:
+        start, end = segment.start + start * segment.speed, min(segment.start + end * segment.speed, segment.end)
+        count = max(int(-(-(end - start) // sub_length)), 1)
+        sub_clips.extend((start + (end - start) * k / count, start + (end - start) * (k + 1) / count)
+                         for k in range(count))
+    kept = [cue for cue in cues if not any(start <= cue.start < end for start, end in ranges)]
+
+    def transcribe(index: int) -> List[Cue]:
+        start, end = sub_clips[index]
+        local_start = (start - segment.start) / segment.speed
+        preceding = " ".join(cue.text for cue in kept if cue.end <= local_start)[-_PROMPT_CARRY_OVER:]
+        audio = clip_audio(source_path, start, end, None, profile)
+        assert audio is not None
+        sub_path = segment.audio_path.with_name(f"{segment.audio_path.stem}-{index}{segment.audio_path.suffix}")
+        sub_response = transcribe_segment(mode, sub_path, (prompt + " " + preceding).strip(), timeout, max_retries,
+                                          language, client, cache, end - start, audio, response_format)
+        # Back to the timeline of the segment.
+        return [cue.retime(1 / segment.speed, local_start) for cue in parse_response(sub_response, response_format)]
+
+    replacements = [cue for index in range(len(sub_clips)) for cue in transcribe(index)]
+    cues = sorted(kept + replacements, key=lambda cue: cue.start)
+    return render_verbose_json(cues) if response_format == "verbose_json" else render_srt(cues)
+
+
+class Job(NamedTuple):
+    """A media file to translate / transcribe."""
+    audio_path: Path
+    progress_directory: Path
+    output_path: Path
+
+
+class ProcessOptions(NamedTuple):
+    """Settings of translation / transcription shared by all the media files of a run.
+
+    See :func:`segment_and_process` for the meaning of each field.
+    ``ffmpeg_workers`` is the number of ffmpeg processes clipping segments (and extracting audio) at the same time.
+    """
+    mode: str
+    segment_length: int = 600
+    overlap: int = 60
+    prompt: str = ""
+    delete_duplicates: int = 3
+    reuse: bool = False
+    timeout: float = 60.
+    max_retries: int = 0
+    language: Optional[str] = None
+    concurrency: int = 1
+    clip_ahead: int = 2
+    keep_audio: bool = True
+    split_on_silence: bool = False
+    silence_search: float = 30.
+    vad: bool = False
+    vad_min_gap: float = 2.
+    upload_profile: str = DEFAULT_UPLOAD_PROFILE
+    speedup: float = 1.
+    speedup_density: Optional[float] = None
+    ffmpeg_workers: int = 1
+    align_overlap: bool = False
+    response_format: str = "srt"
+    resplit: bool = False
+    resplit_gap: Optional[float] = None
+    resplit_length: float = 60.
+    stream_output: bool = False
+
+
+class _JobState:
+    """Progress of a job in :func:`process_jobs`."""
+
+    def __init__(self, job: Job, journal: Journal, source_path: Path, time_map: Optional[TimeMap],
+                 segments: List[Segment], merger: SubtitleMerger):
+        self.job = job
+        self.journal = journal
+        self.source_path = source_path
+        self.time_map = time_map
+        self.segments = segments
+        self.merger = merger
+        self.written = 0
+
+
+def is_reusable(reuse: bool, path: Path, journal: Optional[Journal], key: str, state: str) -> bool:
+    """Whether a file produced by a previous run can be reused.
+
+    With a journal, only the files recorded complete (and unchanged since) are reused.
+    Otherwise, any existing file is.
+    """
+    if not reuse:
+        return False
+    if journal is None:
+        return path.exists()
+    return journal.is_complete(key, state, path)
+
+
+def prepare_audio(audio_path: Path, progress_directory: Path, reuse: bool,
+                  vad: bool = False, vad_min_gap: float = 2.,
+                  journal: Optional[Journal] = None) -> Tuple[Path, Optional[TimeMap]]:
+    """Extract the audio to be segmented from a media file.
+
+    Args:
+        audio_path (Path): Path to the media file.
+        progress_directory (Path): Directory where the extracted audio is saved.
+        reuse (bool): Whether to reuse the audio extracted previously.
+        vad (bool): Whether to remove non-speech parts of the audio.
+        vad_min_gap (float): Minimum length (in seconds) of a non-speech span to be removed.
+        journal (Journal, optional): Journal of the progress directory, recording the extracted audio.
+
+    Returns:
+        Tuple[Path, Optional[TimeMap]]: Path to the extracted audio, and the mapping from its timeline
+        to the original media if some parts have been removed.
+    """
+    # Everything downstream reads from the extracted audio rather than the original media.
+    extracted_path = progress_directory / "audio.flac"
+    if is_reusable(reuse, extracted_path, journal, "audio", EXTRACTED):
+        _logger.info("Reuse extracted audio: %s", extracted_path)
+    else:
+        extract_audio(audio_path, extracted_path)
+        if journal is not None:
+            journal.record("audio", EXTRACTED, extracted_path)
+
+    if not vad:
+        return extracted_path, None
+
+    # Segments are cut from the speech-only audio. Subtitle timestamps are mapped back when merging.
+    speech_path = progress_directory / "speech.flac"
+    regions_path = progress_directory / "speech.json"
+    if is_reusable(reuse, speech_path, journal, "speech", EXTRACTED) and regions_path.exists():
+        _logger.info("Reuse speech-only audio: %s", speech_path)
+        return speech_path, TimeMap.load(regions_path)
+
+    regions = detect_speech(extracted_path, min_gap=vad_min_gap)
+    if not regions:
+        _logger.warning("No speech detected. Voice activity detection is skipped.")
+        return extracted_path, None
+    extract_regions(extracted_path, regions, speech_path)
+    time_map = TimeMap(regions)
+    time_map.save(regions_path)
+    if journal is not None:
+        journal.record("speech", EXTRACTED, speech_path)
+    return speech_path, time_map
+
+
+def process_jobs(jobs: List[Job], options: ProcessOptions,
+                 client: Optional[OpenAIClient] = None, cache: Optional[TranscriptionCache] = None) -> None:
+    """Translate / transcribe multiple media files.
+
+    Segments of all the files go through one pipeline of stages: probe, clip, upload and write subtitle.
+    The stages run concurrently, so that the next segments are clipped while the current ones are being uploaded,
+    and the ffmpeg workers and OpenAI workers are shared by all the files.
+    The subtitles of a file are merged incrementally as its segments are done.
+
+    Progress of each file is recorded in a journal in its progress directory. With ``options.reuse``,
+    a restarted run only redoes the steps not recorded complete, e.g., after a crash.
+
+    Args:
+        jobs (List[Job]): Media files to process, with their progress directories and output paths.
+        options (ProcessOptions): Settings of the processing.
+        client (OpenAIClient, optional): The client to send requests with.
+            Defaults to a new client with one pooled connection per concurrent request.
+        cache (TranscriptionCache, optional): Persistent cache of results across runs. Defaults to no cache.
+    """
+    if options.mode not in ["translations", "transcriptions"]:
+        raise ValueError(f"Invalid mode: {options.mode}, should be one of 'translations', 'transcriptions'")
+
+    _logger.info("Mode: %s", options.mode)
+
+    if options.upload_profile not in UPLOAD_PROFILES:
+        raise ValueError(f"Invalid upload profile: {options.upload_profile}, "
+                         f"should be one of {list(UPLOAD_PROFILES)}")
+    profile = UPLOAD_PROFILES[options.upload_profile]
+    if options.response_format not in ["srt", "verbose_json"]:
+        raise ValueError(f"Invalid response format: {options.response_format}, should be one of 'srt', 'verbose_json'")
+    subtitle_suffix = "json" if options.response_format == "verbose_json" else "srt"
+    segment_length, overlap = options.segment_length, options.overlap
+    # Make sure the segments fit in the upload size limit in the first place.
+    max_segment_length = int(profile.max_duration(MAX_UPLOAD_BYTES))
+    if segment_length > max_segment_length:
+        _logger.warning("Segment length %d is too long for upload profile %s. Shortened to %d.",
+                        segment_length, options.upload_profile, max_segment_length)
+        segment_length = max_segment_length
+        overlap = min(overlap, segment_length // 2)
+
+    if client is None:
+        client = OpenAIClient(load_config(timeout=options.timeout, max_retries=options.max_retries),
+                              pool_size=options.concurrency)
+
+    def merge(state: _JobState) -> None:
+        state.merger.close()
+        state.journal.record("output", MERGED, state.job.output_path)
+        state.journal.close()
+
+    # Extracting audio and clipping segments share one budget of ffmpeg processes.
+    ffmpeg_slots = threading.Semaphore(options.ffmpeg_workers)
+
+    def prepare(job: Job) -> _JobState:
+        journal = Journal(job.progress_directory / "journal.jsonl", resume=options.reuse)
+        with ffmpeg_slots:
+            source_path, time_map = prepare_audio(job.audio_path, job.progress_directory, options.reuse,
+                                                  options.vad, options.vad_min_gap, journal)
+            _logger.info("Segmenting audio file %s into segments of length %d with overlap %d",
+                         source_path, segment_length, overlap)
+            segments = list(probe_segments(source_path, job.progress_directory, segment_length, overlap,
+                                           options.split_on_silence, options.silence_search, profile.suffix,
+                                           options.speedup, options.speedup_density, subtitle_suffix))
+        merger = SubtitleMerger(job.output_path, options.delete_duplicates, time_map, options.align_overlap,
+                                options.stream_output)
+        return _JobState(job, journal, source_path, time_map, segments, merger)
+
+    def probe() -> Iterator[Tuple[_JobState, Segment]]:
+        # Audio of the next few files is extracted while the segments of the current file are being processed.
+        # The pipeline closes this generator when it stops early, and the files not started yet are cancelled.
+        executor = ThreadPoolExecutor(max_workers=options.ffmpeg_workers)
+        pending = iter(jobs)
+        futures: Deque["Future[_JobState]"] = deque(
+            executor.submit(prepare, job) for _, job in zip(range(options.ffmpeg_workers), pending))
+        try:
+            while futures:
+                state = futures.popleft().result()
+                next_job = next(pending, None)
+                if next_job is not None:
+                    futures.append(executor.submit(prepare, next_job))
+                if not state.segments:
+                    merge(state)
+                for segment in state.segments:
+                    yield state, segment
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def clip(task: Tuple[_JobState, Segment]) -> Tuple[_JobState, Segment, bool, Optional[bytes]]:
+        state, segment = task
+        key = segment.subtitle_path.stem
+        # Checked once here, as verifying the checksum reads the whole file.
+        if is_reusable(options.reuse, segment.subtitle_path, state.journal, key, TRANSCRIBED):
+            return state, segment, True, None  # Nothing to upload. No need to clip.
+        if is_reusable(options.reuse, segment.audio_path, state.journal, key, CLIPPED):
+            _logger.info("Reuse generated audio: %s", segment.audio_path)
+            return state, segment, False, None
+        # Seeking in the extracted audio is cheap, so each segment only decodes its own range.
+        # Segment audios that won't be kept are never written to disk.
+        with ffmpeg_slots:
+            audio = clip_audio(state.source_path, segment.start, segment.end,
+                               segment.audio_path if options.keep_audio else None, profile, speed=segment.speed)
+        if audio is None:
+            state.journal.record(key, CLIPPED, segment.audio_path)
+        return state, segment, False, audio
+
+    def upload(clipped: Tuple[_JobState, Segment, bool, Optional[bytes]]) -> Tuple[_JobState, Segment, Optional[str]]:
+        state, segment, transcribed, audio = clipped
+        if transcribed:
+            _logger.info("Subtitle already exists: %s", segment.subtitle_path)
+            return state, segment, None
+        response = transcribe_segment(options.mode, segment.audio_path, options.prompt,
+                                      options.timeout, options.max_retries, options.language,
+                                      client, cache, (segment.end - segment.start) / segment.speed, audio,
+                                      options.response_format)
+        if options.resplit:
+            response = resplit_segment(options.mode, state.source_path, segment, response, options.prompt,
+                                       options.timeout, options.max_retries, options.language, client, cache,
+                                       profile, options.response_format,
+                                       options.delete_duplicates or 3, options.resplit_gap, options.resplit_length)
+        return state, segment, response
+
+    def write(result: Tuple[_JobState, Segment, Optional[str]]) -> Segment:
+        state, segment, response = result
+        if response is not None:
+            atomic_write_text(segment.subtitle_path, response)
+            state.journal.record(segment.subtitle_path.stem, TRANSCRIBED, segment.subtitle_path)
+            _logger.info("Subtitle saved: %s", segment.subtitle_path)
+        # Segments finish out of order with concurrent uploads. The merger waits for the ones before.
+        state.merger.add(state.segments.index(segment), segment.subtitle_path, segment.start, segment.end,
+                         segment.speed)
+        state.written += 1
+        if state.written == len(state.segments):
+            merge(state)
+        return segment
+
+    run_pipeline(
+        probe(),
+        [
+            Stage("clip", clip, workers=options.ffmpeg_workers),
+            Stage("upload", upload, workers=options.concurrency, queue_size=options.clip_ahead),
+            Stage("write", write, queue_size=options.concurrency),
+        ]
+    )
 
 
 def segment_and_process(mode: str, audio_path: Path, progress_directory: Path, output_path: Path,
                         segment_length: int, overlap: int, prompt: str,
                         delete_duplicates: int, reuse: bool,
                         timeout: float, max_retries: int,
-                        language: Optional[str] = None) -> None:
+                        language: Optional[str] = None, concurrency: int = 1,
+                        clip_ahead: int = 2, keep_audio: bool = True,
+                        client: Optional[OpenAIClient] = None,
+                        split_on_silence: bool = False, silence_search: float = 30.,
+                        vad: bool = False, vad_min_gap: float = 2.,
+                        cache: Optional[TranscriptionCache] = None,
+                        upload_profile: str = DEFAULT_UPLOAD_PROFILE,
+                        speedup: float = 1., speedup_density: Optional[float] = None,
+                        align_overlap: bool = False, response_format: str = "srt",
+                        resplit: bool = False,
+                        resplit_gap: Optional[float] = None, resplit_length: float = 60.,
+                        stream_output: bool = False) -> None:
     """Segment an audio file and process each segment.
     Results are saved in the progress_directory.
 
+    Segments go through a pipeline of stages: probe, clip, upload and write subtitle.
+    The stages run concurrently, so that the next segments are clipped while the current ones are being uploaded.
+
     Args:
         mode (str): The mode of the request. Can be "translations" or "transcriptions".
         audio_path (Path): Path to the audio file to segment and process.
@@ -155,34 +900,53 @@ def segment_and_process(mode: str, audio_path: Path, progress_directory: Path, o
         timeout (float): The timeout for OpenAI requests.
         max_retries (int): The maximum number of OpenAI request retries.
         language (str, optional): The language of the transcription. Defaults to None. Only useful when mode is "transcriptions".
+        concurrency (int, optional): Maximum number of segments being processed by OpenAI at the same time. Defaults to 1.
+        clip_ahead (int, optional): Maximum number of clipped segments waiting to be uploaded. Defaults to 2.
+            Clipping pauses when the limit is reached, which bounds the memory / disk usage.
+        keep_audio (bool, optional): Whether to save the segment audios in the progress directory. Defaults to True.
+            If False, segments are clipped into memory and handed to the uploader directly.
+        client (OpenAIClient, optional): The client to send requests with.
+            Defaults to a new client with one pooled connection per concurrent request.
+        split_on_silence (bool, optional): Whether to split segments on silence. Defaults to False.
+        silence_search (float, optional): Length of the range (in seconds) searched for silence
+            before each nominal split point. Defaults to 30.
+        vad (bool, optional): Whether to remove non-speech parts of the audio before segmentation. Defaults to False.
+        vad_min_gap (float, optional): Minimum length (in seconds) of a non-speech span to be removed. Defaults to 2.
+        cache (TranscriptionCache, optional): Persistent cache of results across runs. Defaults to no cache.
+        upload_profile (str, optional): Name of the encoding of uploaded segments, one of UPLOAD_PROFILES.
+            Defaults to DEFAULT_UPLOAD_PROFILE.
+        speedup (float, optional): Playback speed of uploaded segments, between 1 and 2. Defaults to 1.
+            Faster playback means fewer billed minutes and shorter uploads.
+        speedup_density (float, optional): If set, only segments whose fraction of voiced frames is below this
+            are sped up. Defaults to None (all segments).
+        align_overlap (bool, optional): Whether to splice neighboring segments where the text in their overlap
+            agrees, instead of at the middle of the overlap. Defaults to False.
+        response_format (str, optional): Format of OpenAI responses, "srt" or "verbose_json". Defaults to "srt".
+            With "verbose_json", cues which are likely hallucinations are deleted based on their confidences,
+            and the final srt is rendered locally.
+        resplit (bool, optional): Whether to transcribe the degenerate ranges of each segment again in shorter clips.
+            Defaults to False. See :func:`resplit_segment`.
+        resplit_gap (float, optional): With resplit, gaps without subtitles longer than this (in seconds)
+            are degenerate too. Defaults to None (gaps are allowed).
+        resplit_length (float, optional): Maximum length of the clips transcribed again in seconds. Defaults to 60.
+        stream_output (bool, optional): Whether to append subtitles to output_path as soon as they are settled,
+            so that it can be read while the rest is being processed. Otherwise, output_path appears when
+            everything is done. Defaults to False.
     """
-    if mode not in ["translations", "transcriptions"]:
-        raise ValueError(f"Invalid mode: {mode}, should be one of 'translations', 'transcriptions'")
-
-    _logger.info("Mode: %s", mode)
-
-    subtitles: List[Tuple[Path, int, int]] = []
-    for segment_path, start, end in segment_audio(audio_path, progress_directory, segment_length, overlap, reuse):
-        subtitle_path = progress_directory / f"{start:05d}-{end:05d}.srt"
-        if reuse and subtitle_path.exists():
-            _logger.info("Subtitle already exists: %s", subtitle_path)
-        else:
-            _logger.info("Using whisper to translate / transcribe %s", segment_path)
-            with segment_path.open("rb") as f:
-                response = openai_audio(f, prompt, mode=mode, timeout=timeout, max_retries=max_retries)
-                subtitle_path.write_text(response, encoding="utf-8", errors="replace")
-                _logger.info("Subtitle saved: %s", subtitle_path)
-        subtitles.append((subtitle_path, start, end))
-
-    _logger.info("Merging subtitles into %s", output_path)
-    merge_subtitles(subtitles, output_path, delete_duplicates)
+    options = ProcessOptions(mode=mode, segment_length=segment_length, overlap=overlap, prompt=prompt,
+                             delete_duplicates=delete_duplicates, reuse=reuse, timeout=timeout,
+                             max_retries=max_retries, language=language, concurrency=concurrency,
+                             clip_ahead=clip_ahead, keep_audio=keep_audio, split_on_silence=split_on_silence,
+                             silence_search=silence_search, vad=vad, vad_min_gap=vad_min_gap,
+                             upload_profile=upload_profile, speedup=speedup, speedup_density=speedup_density,
+                             align_overlap=align_overlap, response_format=response_format,
+                             resplit=resplit, resplit_gap=resplit_gap,
+                             resplit_length=resplit_length, stream_output=stream_output)
+    process_jobs([Job(audio_path, progress_directory, output_path)], options, client, cache)
 
 
-def main(mode: str):
-    parser = argparse.ArgumentParser("Translate / transcribe audio to srt subtitles.")
-    parser.add_argument("input", type=str, help="Path to audio file to be processed.")
-    parser.add_argument("--output", "-o", type=str, default=None,
-                        help="Path to output. A *.progress directory and a *.srt file will be created. By default, it's same as input.")
+def add_process_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add command line options of :class:`ProcessOptions` to a parser."""
     parser.add_argument("--keep-progress", default=False, action="store_true",
                         help="Whether to keep the progress directory at the end.")
     parser.add_argument("--prompt", "-p", type=str, default="", help="Prompt to use for translation / transcription.")
@@ -192,30 +956,135 @@ def main(mode: str):
     parser.add_argument("--delete-duplicates", type=int, default=3,
                         help="Number of consecutive duplicate subtitles to delete. "
                              "Useful for removing false positive of silence. Setting to 0 to disable.")
-    parser.add_argument("--reuse", default=False, action="store_true", help="Whether to reuse existing files.")
+    parser.add_argument("--align-overlap", default=False, action="store_true",
+                        help="Splice neighboring segments where the text in their overlap agrees, instead of "
+                             "cutting at the middle. Lines are rarely lost or duplicated in this mode, "
+                             "so a much smaller overlap (e.g., 10 - 15 seconds) is enough.")
+    parser.add_argument("--stream-output", default=False, action="store_true",
+                        help="Append subtitles to the output as soon as they are settled, so that the beginning "
+                             "can be read while the rest is being processed.")
+    parser.add_argument("--response-format", type=str, default="srt", choices=["srt", "verbose_json"],
+                        help="Format of OpenAI responses. verbose_json comes with confidences, "
+                             "which are used to delete subtitles Whisper is likely to have made up.")
+    parser.add_argument("--resplit", default=False, action="store_true",
+                        help="Detect degenerate results (e.g., a line repeated over and over) and transcribe only "
+                             "those ranges again in shorter clips.")
+    parser.add_argument("--resplit-gap", type=float, default=None,
+                        help="With --resplit, also transcribe again gaps without subtitles longer than this "
+                             "(in seconds). Best used with --vad, so that real silence is not mistaken for a failure.")
+    parser.add_argument("--resplit-length", type=float, default=60.,
+                        help="Maximum length (in seconds) of the clips transcribed again with --resplit.")
+    parser.add_argument("--reuse", default=False, action="store_true",
+                        help="Whether to resume from the progress directory. "
+                             "Only the files recorded complete in its journal are reused.")
     parser.add_argument("--timeout", default=60., type=float, help="Timeout of OpenAI requests.")
     parser.add_argument("--max-retries", default=0, type=int, help="Max retries of OpenAI requests.")
     parser.add_argument("--language", type=str, default=None, help="Language of the transcription, in ISO 639-1 format.")
-    args = parser.parse_args()
+    parser.add_argument("--concurrency", "-j", type=int, default=1,
+                        help="Number of segments sent to OpenAI concurrently.")
+    parser.add_argument("--ffmpeg-workers", type=int, default=1,
+                        help="Number of ffmpeg processes extracting and clipping audio concurrently.")
+    parser.add_argument("--clip-ahead", type=int, default=2,
+                        help="Number of segments clipped in advance while waiting for upload.")
+    parser.add_argument("--split-on-silence", default=False, action="store_true",
+                        help="Split segments at the quietest point near each nominal split point. "
+                             "Words are rarely cut in this mode, so a much smaller overlap (e.g., 5 seconds) is enough.")
+    parser.add_argument("--silence-search", type=float, default=30.,
+                        help="Length of the range (in seconds) searched for silence before each nominal split point.")
+    parser.add_argument("--vad", default=False, action="store_true",
+                        help="Detect voice activity and skip long non-speech parts (e.g., music, credits) before upload.")
+    parser.add_argument("--vad-min-gap", type=float, default=2.,
+                        help="Minimum length (in seconds) of a non-speech span to be skipped.")
+    parser.add_argument("--upload-profile", type=str, default=DEFAULT_UPLOAD_PROFILE, choices=list(UPLOAD_PROFILES),
+                        help="Encoding of the audio segments uploaded to OpenAI.")
+    parser.add_argument("--speedup", type=float, default=1.,
+                        help="Play segments faster (1.0 - 2.0) before uploading. Cuts billed minutes and upload time, "
+                             "at some cost of accuracy.")
+    parser.add_argument("--speedup-density", type=float, default=None,
+                        help="Only speed up segments whose fraction of voiced frames is below this (0 - 1), "
+                             "i.e., where speech is sparse. By default, all segments are sped up.")
+    parser.add_argument("--requests-per-minute", type=float, default=None,
+                        help="Maximum number of OpenAI requests per minute. Unlimited by default.")
+    parser.add_argument("--audio-minutes-per-minute", type=float, default=None,
+                        help="Maximum minutes of audio uploaded to OpenAI per minute. Unlimited by default.")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Directory of the persistent cache of results. Defaults to ~/.cache/whispermovie.")
+    parser.add_argument("--no-cache", default=False, action="store_true",
+                        help="Do not read or write the persistent cache of results.")
 
-    audio_path = Path(args.input)
-    if not audio_path.exists():
-        raise ValueError(f"Input file {audio_path} does not exist.")
+
+def options_from_arguments(mode: str, args: argparse.Namespace) -> ProcessOptions:
+    """Validate the options added by :func:`add_process_arguments` and convert them to :class:`ProcessOptions`."""
     if args.segment < 10:
         raise ValueError("segment must be at least 10 seconds.")
     if args.overlap < 0 or args.overlap >= args.segment:
         raise ValueError("overlap must be at least 0 and less than segment.")
     if args.delete_duplicates <= 1:
         raise ValueError("delete_duplicates must be at least 2 or zero.")
+    if args.concurrency < 1:
+        raise ValueError("concurrency must be at least 1.")
+    if args.ffmpeg_workers < 1:
+        raise ValueError("ffmpeg_workers must be at least 1.")
+    if args.clip_ahead < 1:
+        raise ValueError("clip_ahead must be at least 1.")
+    if not 1. <= args.speedup <= 2.:
+        raise ValueError("speedup must be between 1 and 2.")
+    if args.silence_search <= 0:
+        raise ValueError("silence_search must be positive.")
+    if args.resplit_length < 1:
+        raise ValueError("resplit_length must be at least 1 second.")
+
+    return ProcessOptions(mode=mode, segment_length=args.segment, overlap=args.overlap, prompt=args.prompt,
+                          delete_duplicates=args.delete_duplicates, reuse=args.reuse, timeout=args.timeout,
+                          max_retries=args.max_retries, language=args.language, concurrency=args.concurrency,
+                          clip_ahead=args.clip_ahead, keep_audio=args.keep_progress,
+                          split_on_silence=args.split_on_silence, silence_search=args.silence_search,
+                          vad=args.vad, vad_min_gap=args.vad_min_gap, upload_profile=args.upload_profile,
+                          speedup=args.speedup, speedup_density=args.speedup_density,
+                          ffmpeg_workers=args.ffmpeg_workers, align_overlap=args.align_overlap,
+                          response_format=args.response_format,
+                          resplit=args.resplit, resplit_gap=args.resplit_gap, resplit_length=args.resplit_length,
+                          stream_output=args.stream_output)
+
+
+def run_jobs(jobs: List[Job], options: ProcessOptions, args: argparse.Namespace) -> None:
+    """Process jobs with one OpenAI client and cache configured from command line arguments.
+
+    Progress directories are removed after all the jobs succeed, unless ``--keep-progress`` is set.
+    """
+    for job in jobs:
+        job.progress_directory.mkdir(parents=True, exist_ok=True)
+    # Resolve OpenAI settings once. They are shared by all the requests of this run.
+    config = load_config(timeout=args.timeout, max_retries=args.max_retries,
+                         requests_per_minute=args.requests_per_minute,
+                         audio_minutes_per_minute=args.audio_minutes_per_minute)
+    cache = None if args.no_cache else TranscriptionCache(Path(args.cache_dir) if args.cache_dir else None)
+    with OpenAIClient(config, pool_size=args.concurrency) as client:
+        process_jobs(jobs, options, client, cache)
+        stats = client.retry_policy.stats()
+        _logger.info("OpenAI requests: %d attempts, %d retries, %d permanent failures, %.1f seconds in backoff",
+                     stats.attempts, stats.retries, stats.permanent_failures, stats.backoff_seconds)
+    if not args.keep_progress:
+        for job in jobs:
+            shutil.rmtree(job.progress_directory)
+
+
+def main(mode: str):
+    parser = argparse.ArgumentParser("Translate / transcribe audio to srt subtitles.")
+    parser.add_argument("input", type=str, help="Path to audio file to be processed.")
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="Path to output. A *.progress directory and a *.srt file will be created. By default, it's same as input.")
+    add_process_arguments(parser)
+    args = parser.parse_args()
+
+    audio_path = Path(args.input)
+    if not audio_path.exists():
+        raise ValueError(f"Input file {audio_path} does not exist.")
+    options = options_from_arguments(mode, args)
 
     if args.output is None:
         args.output = Path(args.input)
 
     progress_directory = Path(args.output).parent / (Path(args.output).stem + ".progress")
     output_path = Path(args.output).parent / (Path(args.output).stem + ".srt")
-    progress_directory.mkdir(parents=True, exist_ok=True)
-    segment_and_process(mode, audio_path, progress_directory, output_path,
-                        args.segment, args.overlap, args.prompt, args.delete_duplicates, args.reuse,
-                        args.timeout, args.max_retries, args.language)
-    if not args.keep_progress:
-        shutil.rmtree(progress_directory)
+    run_jobs([Job(audio_path, progress_directory, output_path)], options, args)
@@ -0,0 +1,131 @@
+import json
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from .srt import format_srt, parse_srt_bytes
+from .utils import get_logger
+
+_logger = get_logger()
+
+# Thresholds used by Whisper itself to tell silence and degenerate (e.g., looping) output.
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.
+COMPRESSION_RATIO_THRESHOLD = 2.4
+
+
+class Cue(NamedTuple):
+    """A subtitle line, with the confidences reported by Whisper if the response is ``verbose_json``.
+
+    Times are in seconds.
+    """
+    start: float
+    end: float
+    text: str
+    avg_logprob: Optional[float] = None
+    no_speech_prob: Optional[float] = None
+    compression_ratio: Optional[float] = None
+
+    def retime(self, speed: float = 1., offset: float = 0.) -> "Cue":
+        """Scale the times by speed, and then shift them by offset."""
+        return self._replace(start=self.start * speed + offset, end=self.end * speed + offset)
+
+    def is_hallucination(self) -> bool:
+        """Whether Whisper is likely to have made up this cue, following the thresholds Whisper uses.
+
+        That is, the audio is probably not speech and the text is not confident, or the text is too repetitive.
+        Always False if the confidences are unknown.
+        """
+        if self.compression_ratio is not None and self.compression_ratio > COMPRESSION_RATIO_THRESHOLD:
+            return True
+        return self.no_speech_prob is not None and self.avg_logprob is not None and \
+            self.no_speech_prob > NO_SPEECH_THRESHOLD and self.avg_logprob < LOGPROB_THRESHOLD
+
+
+def parse_srt(text: str) -> List[Cue]:
+    """Parse subtitles in srt format."""
+    starts, ends, texts = parse_srt_bytes(text.encode("utf-8"))
+    return [Cue(start / 1000, end / 1000, text) for start, end, text in zip(starts.tolist(), ends.tolist(), texts)]
+
+
+def parse_verbose_json(text: str) -> List[Cue]:
+    """Parse a ``verbose_json`` response of OpenAI audio API. Each segment of the response becomes a cue."""
+    response = json.loads(text)
+    segments = response.get("segments") or []
+    return [Cue(float(segment["start"]), float(segment["end"]), segment["text"].strip(),
+                segment.get("avg_logprob"), segment.get("no_speech_prob"), segment.get("compression_ratio"))
+            for segment in segments]
+
+
+def parse_response(text: str, response_format: str) -> List[Cue]:
+    """Parse a response of OpenAI audio API in "srt" or "verbose_json" format."""
+    if response_format == "verbose_json":
+        return parse_verbose_json(text)
+    return parse_srt(text)
+
+
+def load_cues(path: Path) -> List[Cue]:
+    """Load cues from a subtitle file. ``*.json`` files are ``verbose_json`` responses. Others are srt."""
+    text = path.read_text(encoding="utf-8", errors="replace")
+    return parse_response(text, "verbose_json" if path.suffix == ".json" else "srt")
+
+
+def find_degenerate_ranges(cues: List[Cue], duration: float, max_repeats: int = 3,
+                           max_gap: Optional[float] = None) -> List[Tuple[float, float]]:
+    """Find the time ranges where Whisper is likely to have failed, e.g., by looping on a line.
+
+    A range is degenerate if its cue is too repetitive (per compression ratio), if it's covered by a run of
+    at least max_repeats identical cues, or if it's a gap of no cue longer than max_gap.
+
+    Args:
+        cues (List[Cue]): Cues of an audio, sorted by start time.
+        duration (float): Duration of the audio in seconds.
+        max_repeats (int): Minimum length of a run of identical cues to be degenerate.
+        max_gap (float, optional): Maximum length of a gap in seconds. Gaps are not checked if not set.
+
+    Returns:
+        List[Tuple[float, float]]: Sorted, non-overlapping degenerate ranges in seconds.
+    """
+    ranges: List[Tuple[float, float]] = []
+    for cue in cues:
+        if cue.compression_ratio is not None and cue.compression_ratio > COMPRESSION_RATIO_THRESHOLD:
+            ranges.append((cue.start, cue.end))
+
+    i = 0
+    while i < len(cues):
+        j = i + 1
+        while j < len(cues) and cues[i].text == cues[j].text:
+            j += 1
+        if j - i >= max_repeats:
+            ranges.append((cues[i].start, cues[j - 1].end))
+        i = j
+
+    if max_gap is not None:
+        bounds = [0.] + [time for cue in cues for time in (cue.start, cue.end)] + [duration]
+        for gap_start, gap_end in zip(bounds[::2], bounds[1::2]):
+            if gap_end - gap_start > max_gap:
+                ranges.append((gap_start, gap_end))
+
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def render_srt(cues: List[Cue], start_index: int = 1) -> str:
+    """Render cues in srt format. Cues are numbered from start_index."""
+    return format_srt([int(round(cue.start * 1000)) for cue in cues], [int(round(cue.end * 1000)) for cue in cues],
+                      [cue.text for cue in cues], start_index)
+
+
+def render_verbose_json(cues: List[Cue]) -> str:
+    """Render cues in the ``verbose_json`` format of OpenAI audio API, so that they can be parsed back as is."""
+    return json.dumps({
+        "text": " ".join(cue.text for cue in cues),
+        "segments": [{"id": index, "start": cue.start, "end": cue.end, "text": cue.text,
+                      "avg_logprob": cue.avg_logprob, "no_speech_prob": cue.no_speech_prob,
+                      "compression_ratio": cue.compression_ratio}
+                     for index, cue in enumerate(cues)],
+    }, ensure_ascii=False)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+# States recorded in a journal.
+EXTRACTED = "extracted"
+CLIPPED = "clipped"
+TRANSCRIBED = "transcribed"
+MERGED = "merged"
+
+
+def file_checksum(path: Path) -> str:
+    """SHA-256 of the content of a file."""
+    hasher = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class Journal:
+    """Append-only log of what has been done for a job, used to resume it safely after a crash.
+
+    Each line of the journal (JSON) records that an item (e.g., a segment) has reached a state,
+    together with the checksum of the artifact produced. A record is written (and fsync-ed) only after
+    its artifact is complete, so an artifact left behind by a killed process is never trusted.
+    A journal can be shared by multiple threads.
+
+    Args:
+        path (Path): Path to the journal file.
+        resume (bool): Whether to load the existing records. Otherwise, the journal starts empty.
+    """
+
+    def __init__(self, path: Path, resume: bool):
+        self.path = path
+        self._records: Dict[Tuple[str, str], Optional[str]] = {}
+        self._lock = threading.Lock()
+        if resume and path.exists():
+            self._load()
+            self._file = path.open("a", encoding="utf-8")
+        else:
+            self._file = path.open("w", encoding="utf-8")
+
+    def _load(self) -> None:
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+                self._records[(record["key"], record["state"])] = record.get("checksum")
+            except (ValueError, KeyError, TypeError):
+                # E.g., the last line torn by a crash.
+                _logger.warning("Ignored broken record in journal %s: %s", self.path, line)
+        _logger.info("Loaded %d records from journal %s", len(self._records), self.path)
+
+    def record(self, key: str, state: str, artifact: Optional[Path] = None) -> None:
+        """Record that an item has reached a state.
+
+        Args:
+            key (str): Identifier of the item.
+            state (str): The state reached.
+            artifact (Path, optional): The file produced. Its checksum is recorded.
+        """
+        checksum = file_checksum(artifact) if artifact is not None else None
+        line = json.dumps({"key": key, "state": state, "checksum": checksum})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records[(key, state)] = checksum
+
+    def is_complete(self, key: str, state: str, artifact: Optional[Path] = None) -> bool:
+        """Check whether an item has reached a state, and its artifact is still intact.
+
+        Args:
+            key (str): Identifier of the item.
+            state (str): The state to check.
+            artifact (Path, optional): The file produced, which must match the recorded checksum.
+        """
+        with self._lock:
+            if (key, state) not in self._records:
+                return False
+            checksum = self._records[(key, state)]
+        if artifact is None:
+            return True
+        return artifact.exists() and file_checksum(artifact) == checksum
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
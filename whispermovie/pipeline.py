@@ -0,0 +1,161 @@
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+# Marks the end of the items in a queue.
+_DONE = object()
+
+# Interval to check whether the pipeline has been aborted while blocking on a queue.
+_POLL_INTERVAL = 0.1
+
+
+class Stage(NamedTuple):
+    """A step of a pipeline.
+
+    Attributes:
+        name (str): Name of the stage, used in logs and thread names.
+        function (Callable[[Any], Any]): Function applied to every item. Its return value is sent to the next stage.
+        workers (int): Number of threads running the function.
+        queue_size (int): Maximum number of items waiting in front of this stage.
+            Upstream stages block when the queue is full, which provides backpressure.
+    """
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 1
+
+
+class _Aborted(Exception):
+    pass
+
+
+class _PipelineState:
+    def __init__(self) -> None:
+        self.abort = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+
+    def fail(self, error: BaseException) -> None:
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.abort.set()
+
+
+def _put(q: "queue.Queue[Any]", item: Any, state: _PipelineState) -> None:
+    while True:
+        if state.abort.is_set():
+            raise _Aborted()
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q: "queue.Queue[Any]", state: _PipelineState) -> Any:
+    while True:
+        if state.abort.is_set():
+            raise _Aborted()
+        try:
+            return q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+
+
+def run_pipeline(items: Iterable[Any], stages: List[Stage]) -> List[Any]:
+    """Send items through a series of stages connected by bounded queues.
+
+    Every stage runs in its own threads, so that all the stages make progress at the same time.
+    The items are produced by iterating ``items`` in a separate thread, which makes ``items`` itself
+    (usually a generator) the first stage of the pipeline. A generator is closed when the pipeline stops,
+    so that it can release what it holds even if it's not exhausted.
+
+    If any stage raises, the whole pipeline is stopped and the exception is re-raised.
+
+    Args:
+        items (Iterable[Any]): Inputs of the first stage.
+        stages (List[Stage]): Stages to go through, in order.
+
+    Returns:
+        List[Any]: Outputs of the last stage, in the same order as ``items``.
+    """
+    if not stages:
+        raise ValueError("At least one stage is required.")
+
+    state = _PipelineState()
+    queues: List["queue.Queue[Any]"] = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    results_queue: "queue.Queue[Any]" = queue.Queue()
+    queues.append(results_queue)
+    # Number of workers still running in each stage. The last one to finish notifies the next stage.
+    running = [stage.workers for stage in stages]
+
+    def feed() -> None:
+        try:
+            for index, item in enumerate(items):
+                _put(queues[0], (index, item), state)
+            for _ in range(stages[0].workers):
+                _put(queues[0], _DONE, state)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            state.fail(e)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    def work(stage_index: int) -> None:
+        stage = stages[stage_index]
+        num_next = stages[stage_index + 1].workers if stage_index + 1 < len(stages) else 1
+        try:
+            while True:
+                item = _get(queues[stage_index], state)
+                if item is _DONE:
+                    break
+                index, value = item
+                _put(queues[stage_index + 1], (index, stage.function(value)), state)
+            with state.lock:
+                running[stage_index] -= 1
+                last = running[stage_index] == 0
+            if last:
+                for _ in range(num_next):
+                    _put(queues[stage_index + 1], _DONE, state)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            _logger.error("Stage %s failed: %r", stage.name, e)
+            state.fail(e)
+
+    threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+    for stage_index, stage in enumerate(stages):
+        for worker_index in range(stage.workers):
+            threads.append(threading.Thread(target=work, args=(stage_index,),
+                                            name=f"pipeline-{stage.name}-{worker_index}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    results: Dict[int, Any] = {}
+    try:
+        while True:
+            item = _get(results_queue, state)
+            if item is _DONE:
+                break
+            index, value = item
+            results[index] = value
+    except _Aborted:
+        pass
+    except BaseException:
+        # E.g., KeyboardInterrupt. Let the worker threads stop as soon as possible.
+        state.abort.set()
+        raise
+
+    for thread in threads:
+        thread.join()
+    if state.error is not None:
+        raise state.error
+    return [results[index] for index in sorted(results)]
@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1., "m": 60., "h": 3600.}
+
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate.
+
+    Tokens are reserved rather than waited for: a caller takes the tokens right away (possibly running into debt)
+    and is told how long to wait before using them. This keeps callers in FIFO order and
+    allows requests larger than the capacity.
+
+    Args:
+        rate_per_minute (float): Number of tokens added per minute.
+        capacity (float, optional): Maximum number of tokens. Defaults to ``rate_per_minute``, i.e., a minute of burst.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take tokens from the bucket.
+
+        Returns:
+            float: Seconds to wait before the tokens can be used.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0. if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Paces requests to stay within per-minute quotas of OpenAI API.
+
+    Besides the local quotas, the limiter can be paused on hints given by the server (e.g., after a 429 response),
+    so that all the threads sharing the limiter back off together rather than retrying in a storm.
+
+    Args:
+        requests_per_minute (float, optional): Maximum number of requests per minute. Unlimited if not set.
+        audio_minutes_per_minute (float, optional): Maximum minutes of audio uploaded per minute. Unlimited if not set.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 audio_minutes_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.audio_minutes = TokenBucket(audio_minutes_per_minute) if audio_minutes_per_minute else None
+        self.blocked_until = 0.
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Block all requests for some seconds from now."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self, audio_minutes: float = 0.) -> float:
+        """Wait until a request can be sent.
+
+        Args:
+            audio_minutes (float): Minutes of audio uploaded with the request.
+
+        Returns:
+            float: Seconds waited.
+        """
+        started = time.monotonic()
+        with self.lock:
+            blocked = self.blocked_until - started
+        if blocked > 0:
+            time.sleep(blocked)
+        wait = 0.
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.audio_minutes is not None and audio_minutes > 0:
+            wait = max(wait, self.audio_minutes.reserve(audio_minutes))
+        if wait > 0:
+            time.sleep(wait)
+        waited = time.monotonic() - started
+        if waited > 1.:
+            _logger.info("Waited %.1f seconds for rate limits.", waited)
+        return waited
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Parse durations like ``1s``, ``20ms`` or ``6m0s`` used by ``x-ratelimit-reset-*`` headers into seconds."""
+    matches = _DURATION_PATTERN.findall(text)
+    if not matches:
+        return None
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in matches)
+
+
+def parse_reset_hint(headers: Mapping[str, str]) -> Optional[float]:
+    """Find out how long to wait from the headers of a rate-limited response.
+
+    ``Retry-After`` (in seconds or an HTTP date) takes precedence.
+    Otherwise, the longest of ``x-ratelimit-reset-requests`` and ``x-ratelimit-reset-tokens`` is used.
+
+    Returns:
+        Optional[float]: Seconds to wait. None if no hint is found.
+    """
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.)
+            except (TypeError, ValueError):
+                pass
+    resets = [parse_duration(headers.get(name, "")) for name in
+              ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"]]
+    resets = [reset for reset in resets if reset is not None]
+    if resets:
+        return max(resets)
+    return None
@@ -0,0 +1,82 @@
+import random
+import threading
+from typing import NamedTuple, Optional
+
+import requests
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+
+class RetryStats(NamedTuple):
+    """Counters of a retry policy."""
+    attempts: int
+    retries: int
+    permanent_failures: int
+    backoff_seconds: float
+
+
+class RetryPolicy:
+    """Decides whether and when a failed OpenAI request is retried.
+
+    Only transient failures are retried: timeouts, connection errors, 408, 409, 429 and 5xx responses.
+    Other failures (e.g., 401 for a wrong key, 400 / 413 for a bad file, or bugs of our own) fail fast.
+    Retries are delayed with exponential backoff and full jitter, so that concurrent requests
+    failing together don't retry together.
+
+    The policy also counts attempts and time spent in backoff. It can be shared by multiple threads.
+
+    Args:
+        base_delay (float): Upper bound of the delay before the first retry, in seconds.
+        max_delay (float): Cap of the upper bound of delays, in seconds.
+    """
+
+    def __init__(self, base_delay: float = 1., max_delay: float = 60.):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._attempts = 0
+        self._retries = 0
+        self._permanent_failures = 0
+        self._backoff_seconds = 0.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+            return True
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None:
+            return status_code in (408, 409, 429) or status_code >= 500
+        return False
+
+    def record_attempt(self) -> None:
+        with self._lock:
+            self._attempts += 1
+
+    def record_permanent_failure(self) -> None:
+        with self._lock:
+            self._permanent_failures += 1
+
+    def backoff(self, num_retries: int, retry_after: Optional[float] = None) -> float:
+        """Compute the delay before a retry and count it.
+
+        Args:
+            num_retries (int): Number of retries of the request so far, including this one.
+            retry_after (float, optional): Delay hinted by the server. Used as-is if given.
+
+        Returns:
+            float: Seconds to wait before the retry.
+        """
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = random.uniform(0., min(self.max_delay, self.base_delay * 2 ** (num_retries - 1)))
+        with self._lock:
+            self._retries += 1
+            self._backoff_seconds += delay
+        return delay
+
+    def stats(self) -> RetryStats:
+        with self._lock:
+            return RetryStats(self._attempts, self._retries, self._permanent_failures, self._backoff_seconds)
@@ -0,0 +1,80 @@
+import re
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+import pysrt
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+# A timing line followed by the text lines of the cue, up to a blank line.
+# The index line before the timing line is skipped by the search.
+_CUE_PATTERN = re.compile(
+    rb"(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})[ \t]*-->[ \t]*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})[^\r\n]*(?:\r?\n|\Z)"
+    rb"((?:[^\r\n]*[^\s][^\r\n]*(?:\r?\n|\Z))*)"
+)
+
+_UNITS = np.array([3600000, 60000, 1000, 1], dtype=np.int64)
+
+
+def _to_milliseconds(fields: np.ndarray) -> np.ndarray:
+    """Convert columns of hours, minutes, seconds and (1 - 3 digit) fractions, as bytes, into milliseconds."""
+    # Padded into a new array, as the width of fields is that of the longest field in the file.
+    fractions = np.char.ljust(fields[:, 3].astype("S3"), 3, b"0")
+    return fields[:, :3].astype(np.int64) @ _UNITS[:3] + fractions.astype(np.int64)
+
+
+def parse_srt_bytes(data: bytes) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Parse subtitles in srt format into columns, without building an object per cue.
+
+    Timestamps of all the cues are converted in one go. If nothing can be parsed from a non-empty input
+    (e.g., a malformed file), pysrt is used instead, which is more lenient.
+
+    Args:
+        data (bytes): Content of a srt file in UTF-8.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, List[str]]: Start and end time (in milliseconds) and text of each cue,
+        in the order of the file.
+    """
+    if data.startswith(b"\xef\xbb\xbf"):
+        data = data[3:]
+    matches = _CUE_PATTERN.findall(data)
+    if not matches:
+        if data.strip():
+            _logger.warning("Failed to parse srt. Falling back to pysrt.")
+            items = pysrt.from_string(data.decode("utf-8", errors="replace"))
+            return (np.array([item.start.ordinal for item in items], dtype=np.int64),
+                    np.array([item.end.ordinal for item in items], dtype=np.int64),
+                    [item.text for item in items])
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), []
+    fields = np.array([match[:8] for match in matches])
+    texts = [match[8].decode("utf-8", errors="replace").replace("\r\n", "\n").rstrip("\n") for match in matches]
+    return _to_milliseconds(fields[:, :4]), _to_milliseconds(fields[:, 4:]), texts
+
+
+def read_srt(path: Path) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Parse a srt file into columns. See :func:`parse_srt_bytes`."""
+    return parse_srt_bytes(path.read_bytes())
+
+
+def format_srt(starts: Union[Sequence[int], np.ndarray], ends: Union[Sequence[int], np.ndarray],
+               texts: Sequence[str], start_index: int = 1) -> str:
+    """Render cues in srt format. Cues are numbered from start_index.
+
+    Args:
+        starts (Sequence[int]): Start time of each cue in milliseconds.
+        ends (Sequence[int]): End time of each cue in milliseconds.
+        texts (Sequence[str]): Text of each cue.
+        start_index (int): Number of the first cue.
+    """
+    times = np.maximum(np.stack([np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)]), 0)
+    # Hours, minutes, seconds and milliseconds of starts and ends, computed for all the cues at once.
+    columns = np.stack([times // 3600000, times // 60000 % 60, times // 1000 % 60, times % 1000], axis=-1)
+    return "".join(
+        "%d\n%02d:%02d:%02d,%03d --> %02d:%02d:%02d,%03d\n%s\n\n" % (index, *start, *end, text)
+        for index, start, end, text in zip(range(start_index, start_index + len(texts)),
+                                           columns[0].tolist(), columns[1].tolist(), texts)
+    )
@@ -0,0 +1,93 @@
+from pathlib import Path
+from typing import List, Sequence, Union
+
+import numpy as np
+
+from .cues import Cue, load_cues
+from .srt import read_srt
+
+
+class CueStore:
+    """Cues stored in columns and sorted by start time, for fast range queries over long transcripts.
+
+    Times are integers in milliseconds. Texts are concatenated into one string and located by offsets,
+    so a store costs a few arrays rather than an object per cue.
+
+    Args:
+        starts (np.ndarray): Start time of each cue in milliseconds, sorted.
+        ends (np.ndarray): End time of each cue in milliseconds.
+        text (str): Texts of all the cues, concatenated.
+        offsets (np.ndarray): Where the text of each cue starts in text, plus the length of text at the end.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, text: str, offsets: np.ndarray):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.text = text
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_texts(cls, starts: Sequence[int], ends: Sequence[int], texts: Sequence[str]) -> "CueStore":
+        """Build a store from the times (in milliseconds) and texts of cues, in any order."""
+        starts_array = np.asarray(starts, dtype=np.int64)
+        order = np.argsort(starts_array, kind="stable")
+        texts = [texts[i] for i in order]
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return cls(starts_array[order], np.asarray(ends, dtype=np.int64)[order], "".join(texts), offsets)
+
+    @classmethod
+    def from_cues(cls, cues: Sequence[Cue]) -> "CueStore":
+        return cls.from_texts([int(round(cue.start * 1000)) for cue in cues],
+                              [int(round(cue.end * 1000)) for cue in cues],
+                              [cue.text for cue in cues])
+
+    @classmethod
+    def load(cls, path: Path) -> "CueStore":
+        """Load cues from a subtitle file. ``*.json`` files are ``verbose_json`` responses. Others are srt.
+
+        Srt files are parsed straight into columns.
+        """
+        if path.suffix == ".json":
+            return cls.from_cues(load_cues(path))
+        return cls.from_texts(*read_srt(path))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text_of(self, index: int) -> str:
+        """Text of a cue."""
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def texts(self, indices: Union[Sequence[int], np.ndarray, None] = None) -> List[str]:
+        """Texts of some cues (all by default)."""
+        if indices is None:
+            indices = range(len(self))
+        return [self.text_of(index) for index in indices]
+
+    def take(self, indices: Union[Sequence[int], np.ndarray]) -> "CueStore":
+        """A store of some cues. Indices must be sorted."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return CueStore.from_texts(self.starts[indices], self.ends[indices], self.texts(indices))
+
+    def retime(self, speed: float = 1., offset: float = 0.) -> "CueStore":
+        """A store with the times scaled by speed and then shifted by offset (in seconds). Texts are shared."""
+        if speed == 1.:
+            shift = int(round(offset * 1000))
+            return CueStore(self.starts + shift, self.ends + shift, self.text, self.offsets)
+        return CueStore(np.round(self.starts * speed + offset * 1000).astype(np.int64),
+                        np.round(self.ends * speed + offset * 1000).astype(np.int64), self.text, self.offsets)
+
+    def first_starting_from(self, seconds: float) -> int:
+        """Index of the first cue starting at or after a time (in seconds). len(self) if there is none."""
+        return int(np.searchsorted(self.starts, int(round(seconds * 1000)), side="left"))
+
+    def between(self, start: float, end: float) -> np.ndarray:
+        """Indices of the cues starting at or after start and ending at or before end (in seconds)."""
+        lower = self.first_starting_from(start)
+        upper = int(np.searchsorted(self.starts, int(round(end * 1000)), side="right"))
+        return lower + np.flatnonzero(self.ends[lower:upper] <= int(round(end * 1000)))
+
+    def text_between(self, start: float, end: float) -> str:
+        """Texts of the cues within a time range (see :meth:`between`), one line per cue."""
+        return "\n".join(self.texts(self.between(start, end)))
@@ -1,10 +1,13 @@
 import argparse
+import math
 import os
-from typing import cast, List, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
 
-import pysrt
-
-from .openai import openai_chat
+from .openai import OpenAIClient, get_default_client, load_config, openai_chat
+from .store import CueStore
+from .tokens import count_tokens, get_token_counter
 from .utils import get_logger
 
 _logger = get_logger()
@@ -26,19 +29,76 @@ def segment_summarize(
     prompt_current: str,
     timeout: float,
     max_retries: int,
+    client: Optional[OpenAIClient] = None,
 ) -> str:
     user_messages = [prompt_prev.format(s.start, s.end, s.summary) for s in prev_summaries] + [
         prompt_current.format(start, end, transcription)
     ]
     messages = [{"role": "system", "content": prompt}, {"role": "user", "content": "\n\n\n".join(user_messages)}]
 
-    summarization = openai_chat(messages, timeout=timeout, max_retries=max_retries)
+    summarization = openai_chat(messages, timeout=timeout, max_retries=max_retries, client=client)
     _logger.info("Summarization (%d - %d): %s", start, end, summarization)
     return summarization
 
 
+class RollingContext:
+    """Previous summaries given as the context of the next segment, within a fixed token budget.
+
+    The last few summaries are kept verbatim. Older ones are folded into a single "story so far" digest,
+    so the context (and the cost of each request) does not grow with the length of the video.
+
+    Args:
+        recent (int): Maximum number of summaries kept verbatim.
+        token_budget (int): Maximum number of tokens of the context. Summaries are folded earlier to fit in it.
+        prompt_prev (str): Prompt for previous summary, formatted with start, end and summary.
+        prompt_fold (str): Prompt for updating the digest, formatted with the maximum number of words of the digest.
+        timeout (float): The timeout for OpenAI requests.
+        max_retries (int): The maximum number of OpenAI request retries.
+        client (OpenAIClient, optional): The client to send the requests with.
+    """
+
+    def __init__(self, recent: int, token_budget: int, prompt_prev: str, prompt_fold: str,
+                 timeout: float, max_retries: int, client: Optional[OpenAIClient] = None):
+        self.recent = recent
+        self.token_budget = token_budget
+        self.prompt_prev = prompt_prev
+        self.prompt_fold = prompt_fold
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.client = client
+        self.digest: Optional[SegmentSummary] = None
+        self.recent_summaries: List[SegmentSummary] = []
+
+    def summaries(self) -> List[SegmentSummary]:
+        """The context: the digest (covering from the beginning) followed by the recent summaries."""
+        return ([self.digest] if self.digest is not None else []) + self.recent_summaries
+
+    def tokens(self) -> int:
+        model = _chat_model(self.client)
+        return sum(count_tokens(self.prompt_prev.format(s.start, s.end, s.summary), model) for s in self.summaries())
+
+    def add(self, summary: SegmentSummary) -> None:
+        self.recent_summaries.append(summary)
+        while len(self.recent_summaries) > self.recent or \
+                (len(self.recent_summaries) > 1 and self.tokens() > self.token_budget):
+            self._fold(self.recent_summaries.pop(0))
+
+    def _fold(self, summary: SegmentSummary) -> None:
+        if self.digest is None:
+            self.digest = summary
+            return
+        # Half of the budget is for the digest, and a word is about 4 / 3 tokens.
+        max_words = max(self.token_budget // 2 * 3 // 4, 50)
+        user_messages = [self.prompt_prev.format(s.start, s.end, s.summary) for s in [self.digest, summary]]
+        messages = [{"role": "system", "content": self.prompt_fold.format(max_words)},
+                    {"role": "user", "content": "\n\n\n".join(user_messages)}]
+        digest = openai_chat(messages, timeout=self.timeout, max_retries=self.max_retries, client=self.client)
+        _logger.info("Story so far (%d - %d): %s", self.digest.start, summary.end, digest)
+        self.digest = SegmentSummary(start=self.digest.start, end=summary.end, summary=digest)
+
+
 def map_summarize(
-    subtitles: pysrt.SubRipFile,
+    subtitles: CueStore,
     segment: int,
     overlap: int,
     prompt: str,
@@ -46,47 +106,223 @@ def map_summarize(
     prompt_current: str,
     timeout: float,
     max_retries: int,
+    client: Optional[OpenAIClient] = None,
+    context: Optional[RollingContext] = None,
+    chunk_tokens: Optional[int] = None,
 ) -> List[SegmentSummary]:
-    duration = int(subtitles[-1].end.ordinal / 1000) + 1
-    current_start = 0
+    """Summarize each segment of a subtitle, given the summaries before it.
+
+    If context is given, only the context is given (see :class:`RollingContext`) instead of all the previous summaries.
+    If chunk_tokens is given, segments are packed up to chunk_tokens tokens (see :func:`chunk_transcription`)
+    instead of being segment seconds long.
+    """
     summaries: List[SegmentSummary] = []
-    while current_start < duration:
-        current_end = min(current_start + segment, duration)
-        subtitles_segment = subtitles.slice(
-            starts_after={"seconds": current_start}, ends_before={"seconds": current_end}
-        )
-        transcription = subtitles_segment.text
+    for current_start, current_end, transcription in _split(subtitles, segment, overlap, chunk_tokens, client):
         summary = segment_summarize(
             start=current_start,
             end=current_end,
             transcription=transcription,
-            prev_summaries=summaries,
+            prev_summaries=summaries if context is None else context.summaries(),
             prompt=prompt,
             prompt_prev=prompt_prev,
             prompt_current=prompt_current,
             timeout=timeout,
             max_retries=max_retries,
+            client=client,
         )
         summaries.append(SegmentSummary(start=current_start, end=current_end, summary=summary))
-        current_start += segment - overlap
+        if context is not None:
+            context.add(summaries[-1])
     return summaries
 
 
+def split_transcription(subtitles: CueStore, segment: int, overlap: int) -> List[Tuple[int, int, str]]:
+    """Split a subtitle into segments of length segment with overlap overlap.
+
+    Returns:
+        List[Tuple[int, int, str]]: Start and end time (in seconds) and the transcription of each segment.
+    """
+    duration = int(subtitles.ends.max() / 1000) + 1 if len(subtitles) else 0
+    current_start = 0
+    segments: List[Tuple[int, int, str]] = []
+    while current_start < duration:
+        current_end = min(current_start + segment, duration)
+        segments.append((current_start, current_end, subtitles.text_between(current_start, current_end)))
+        current_start += segment - overlap
+    return segments
+
+
+def chunk_transcription(
+    subtitles: CueStore, max_tokens: int, overlap: int = 0, model: str = "gpt-3.5-turbo"
+) -> List[Tuple[int, int, str]]:
+    """Split a subtitle into segments of up to max_tokens tokens, on cue boundaries.
+
+    A cue longer than max_tokens makes a segment on its own.
+
+    Args:
+        subtitles (CueStore): The subtitle.
+        max_tokens (int): Maximum number of tokens of each segment.
+        overlap (int): Cues starting in the last overlap seconds of a segment are repeated in the next segment,
+            as long as they take no more than half of max_tokens.
+        model (str): Model whose tokenizer counts the tokens.
+
+    Returns:
+        List[Tuple[int, int, str]]: Start and end time (in seconds) and the transcription of each segment.
+    """
+    count = get_token_counter(model)
+    tokens = [count(text) + 1 for text in subtitles.texts()]  # One more for the line break.
+    starts, ends = subtitles.starts / 1000, subtitles.ends / 1000
+    segments: List[Tuple[int, int, str]] = []
+    first, last = 0, -1
+    while last + 1 < len(subtitles):
+        # Every segment takes at least one new cue.
+        last += 1
+        total = sum(tokens[first : last + 1])
+        while total > max_tokens and first < last:
+            # No room for the overlap.
+            total -= tokens[first]
+            first += 1
+        if tokens[last] > max_tokens:
+            _logger.warning(
+                "Subtitle at %.3f seconds has %d tokens, more than %d.", starts[last], tokens[last], max_tokens
+            )
+        while last + 1 < len(subtitles) and total + tokens[last + 1] <= max_tokens:
+            last += 1
+            total += tokens[last]
+        start, end = starts[first], ends[first : last + 1].max()
+        segments.append((int(start), int(math.ceil(end)), "\n".join(subtitles.texts(range(first, last + 1)))))
+
+        # The next segment starts within this one, but after its first cue.
+        previous_first, first, overlap_tokens = first, last + 1, 0
+        while (
+            first - 1 > previous_first
+            and starts[first - 1] >= end - overlap
+            and overlap_tokens + tokens[first - 1] <= max_tokens // 2
+        ):
+            first -= 1
+            overlap_tokens += tokens[first]
+    return segments
+
+
+def _chat_model(client: Optional[OpenAIClient]) -> str:
+    """The model that the requests of client are sent to, whose tokenizer counts the tokens."""
+    return (client if client is not None else get_default_client()).config.chat_model
+
+
+def _split(
+    subtitles: CueStore, segment: int, overlap: int, chunk_tokens: Optional[int], client: Optional[OpenAIClient]
+) -> List[Tuple[int, int, str]]:
+    if chunk_tokens:
+        return chunk_transcription(subtitles, chunk_tokens, overlap, _chat_model(client))
+    return split_transcription(subtitles, segment, overlap)
+
+
+def parallel_map_summarize(
+    subtitles: CueStore,
+    segment: int,
+    overlap: int,
+    prompt: str,
+    prompt_prev: str,
+    prompt_current: str,
+    timeout: float,
+    max_retries: int,
+    client: Optional[OpenAIClient] = None,
+    workers: int = 4,
+    chunk_tokens: Optional[int] = None,
+) -> List[SegmentSummary]:
+    """Summarize each segment of a subtitle independently, with up to workers requests at the same time.
+
+    Segments are split as in :func:`map_summarize`.
+    """
+
+    def summarize(window: Tuple[int, int, str]) -> SegmentSummary:
+        start, end, transcription = window
+        summary = segment_summarize(
+            start=start,
+            end=end,
+            transcription=transcription,
+            prev_summaries=[],
+            prompt=prompt,
+            prompt_prev=prompt_prev,
+            prompt_current=prompt_current,
+            timeout=timeout,
+            max_retries=max_retries,
+            client=client,
+        )
+        return SegmentSummary(start=start, end=end, summary=summary)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(summarize, _split(subtitles, segment, overlap, chunk_tokens, client)))
+
+
 def reduce_summarize(
     summaries: List[SegmentSummary],
     prompt_prev: str,
     prompt_reduce: str,
     timeout: float,
     max_retries: int,
+    client: Optional[OpenAIClient] = None,
 ) -> str:
     user_messages = [prompt_prev.format(s.start, s.end, s.summary) for s in summaries]
     messages = [{"role": "system", "content": prompt_reduce}, {"role": "user", "content": "\n\n\n".join(user_messages)}]
 
-    summarization = openai_chat(messages, timeout=timeout, max_retries=max_retries)
+    summarization = openai_chat(messages, timeout=timeout, max_retries=max_retries, client=client)
     _logger.info("Summarization (reduce): %s", summarization)
     return summarization
 
 
+def tree_reduce_summarize(
+    summaries: List[SegmentSummary],
+    prompt_prev: str,
+    prompt_reduce: str,
+    prompt_reduce_part: str,
+    timeout: float,
+    max_retries: int,
+    client: Optional[OpenAIClient] = None,
+    fan_out: int = 4,
+    workers: int = 4,
+) -> str:
+    """Reduce summaries level by level, merging up to fan_out consecutive summaries in each request.
+
+    Requests of the same level are sent concurrently, so it takes about log(len(summaries), fan_out) round trips.
+
+    Args:
+        summaries (List[SegmentSummary]): Summaries of consecutive segments.
+        prompt_prev (str): Prompt for previous summary.
+        prompt_reduce (str): Prompt for the summary of the full video, used at the top level.
+        prompt_reduce_part (str): Prompt for the summary of a part, used at lower levels.
+            Formatted with the start and end time of the part.
+        timeout (float): The timeout for OpenAI requests.
+        max_retries (int): The maximum number of OpenAI request retries.
+        client (OpenAIClient, optional): The client to send the requests with.
+        fan_out (int): Maximum number of summaries merged in one request.
+        workers (int): Maximum number of requests at the same time.
+
+    Returns:
+        str: Summary of the full video.
+    """
+    if fan_out < 2:
+        raise ValueError("fan_out must be at least 2.")
+
+    def reduce_part(group: List[SegmentSummary]) -> SegmentSummary:
+        if len(group) == 1:
+            return group[0]
+        start, end = group[0].start, group[-1].end
+        summary = reduce_summarize(
+            group, prompt_prev, prompt_reduce_part.format(start, end), timeout, max_retries, client
+        )
+        return SegmentSummary(start=start, end=end, summary=summary)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(summaries) > fan_out:
+            groups = [summaries[i : i + fan_out] for i in range(0, len(summaries), fan_out)]
+            _logger.info("Reducing %d summaries into %d", len(summaries), len(groups))
+            summaries = list(executor.map(reduce_part, groups))
+    if len(summaries) == 1:
+        return summaries[0].summary
+    return reduce_summarize(summaries, prompt_prev, prompt_reduce, timeout, max_retries, client)
+
+
 def main():
     parser = argparse.ArgumentParser("Summarize a subtitle file")
 
@@ -116,11 +352,64 @@ def main():
         default="Please write a summary of the full video.",
     )
     parser.add_argument(
-        "--segment", "-s", type=int, default=600, help="The segment to summarize. Defaults to 600 seconds."
+        "--prompt-reduce-part",
+        type=str,
+        help="Prompt for summary of a part of summaries in parallel mode. Formatted with start and end time.",
+        default="Please write a summary of the video from {} seconds to {} seconds.",
+    )
+    parser.add_argument(
+        "--prompt-fold",
+        type=str,
+        help="Prompt for updating the summary of everything before the recent segments. "
+        "Formatted with the maximum number of words.",
+        default="Your task is to maintain a running summary of a video, i.e., the story so far. "
+        "The user will give the current running summary and the summary of the part after it. "
+        "Please rewrite the running summary to cover both, in no more than {} words.",
+    )
+    parser.add_argument(
+        "--context",
+        type=str,
+        choices=["rolling", "all"],
+        default="all",
+        help="Context given when summarizing each segment. "
+        "all: all the previous summaries, which grows with the length of the video. "
+        "rolling: the last few summaries plus a running summary of the story so far, within a fixed token budget. "
+        "Updating the running summary takes one more request per segment, so it's slower but fits long videos.",
+    )
+    parser.add_argument(
+        "--recent", type=int, default=3, help="Number of previous summaries given verbatim with rolling context."
+    )
+    parser.add_argument(
+        "--context-tokens", type=int, default=1500, help="Maximum number of tokens of rolling context."
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=2000,
+        help="Maximum number of tokens of the transcription summarized in each request. "
+        "Segments are packed up to this on subtitle boundaries. Set to 0 to use segments of fixed length instead.",
+    )
+    parser.add_argument(
+        "--segment",
+        "-s",
+        type=int,
+        default=None,
+        help="The segment to summarize, when --chunk-tokens is 0. Defaults to 600 seconds.",
     )
     parser.add_argument(
         "--overlap", "-lap", type=int, default=60, help="Length of overlap between segments in seconds."
     )
+    parser.add_argument(
+        "--parallel",
+        default=False,
+        action="store_true",
+        help="Summarize segments independently and concurrently, then merge the summaries level by level. "
+        "Much faster for long videos, but each segment is summarized without knowing what happens before.",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent requests in parallel mode.")
+    parser.add_argument(
+        "--fan-out", type=int, default=4, help="Number of summaries merged in each request in parallel mode."
+    )
     parser.add_argument("--timeout", default=60.0, type=float, help="Timeout of OpenAI requests.")
     parser.add_argument("--max-retries", default=0, type=int, help="Max retries of OpenAI requests.")
 
@@ -128,24 +417,77 @@ def main():
 
     if not os.path.exists(args.input_file):
         raise RuntimeError(f"File {args.input_file} does not exist.")
+    if args.segment is None:
+        args.segment = 600
+    elif args.chunk_tokens:
+        _logger.warning(
+            "--segment is ignored as segments are packed up to --chunk-tokens. Set --chunk-tokens to 0 to use it."
+        )
+    # Checked before any request is sent, so that no request is wasted on invalid arguments.
+    if args.context == "rolling" and args.recent < 1:
+        raise ValueError("recent must be at least 1.")
+    if args.parallel and args.workers < 1:
+        raise ValueError("workers must be at least 1.")
+    if args.parallel and args.fan_out < 2:
+        raise ValueError("fan_out must be at least 2.")
 
-    subtitle = pysrt.open(args.input_file)
-    summaries = map_summarize(
-        subtitle,
-        args.segment,
-        args.overlap,
-        args.prompt,
-        args.prompt_prev,
-        args.prompt_current,
-        args.timeout,
-        args.max_retries,
+    # Resolve OpenAI settings once. They are shared by all the requests of this run.
+    client = OpenAIClient(
+        load_config(timeout=args.timeout, max_retries=args.max_retries), pool_size=args.workers if args.parallel else 1
     )
-    if len(summaries) == 1:
-        final_summary = summaries[0].summary
+
+    context = None
+    if args.context == "rolling":
+        context = RollingContext(
+            args.recent, args.context_tokens, args.prompt_prev, args.prompt_fold, args.timeout, args.max_retries, client
+        )
+
+    subtitle = CueStore.load(Path(args.input_file))
+    if args.parallel:
+        summaries = parallel_map_summarize(
+            subtitle,
+            args.segment,
+            args.overlap,
+            args.prompt,
+            args.prompt_prev,
+            args.prompt_current,
+            args.timeout,
+            args.max_retries,
+            client,
+            args.workers,
+            args.chunk_tokens,
+        )
+        final_summary = tree_reduce_summarize(
+            summaries,
+            args.prompt_prev,
+            args.prompt_reduce,
+            args.prompt_reduce_part,
+            args.timeout,
+            args.max_retries,
+            client,
+            args.fan_out,
+            args.workers,
+        )
     else:
-        final_summary = reduce_summarize(
-            summaries, args.prompt_prev, args.prompt_reduce, args.timeout, args.max_retries
+        summaries = map_summarize(
+            subtitle,
+            args.segment,
+            args.overlap,
+            args.prompt,
+            args.prompt_prev,
+            args.prompt_current,
+            args.timeout,
+            args.max_retries,
+            client,
+            context,
+            args.chunk_tokens,
         )
+        if len(summaries) == 1:
+            final_summary = summaries[0].summary
+        else:
+            final_summary = reduce_summarize(
+                summaries, args.prompt_prev, args.prompt_reduce, args.timeout, args.max_retries, client
+            )
 
     print("Summary:")
     print(final_summary)
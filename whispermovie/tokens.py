@@ -0,0 +1,61 @@
+import math
+import re
+from typing import Callable, Dict
+
+from .utils import get_logger
+
+_logger = get_logger()
+
+# Ranges of CJK characters (kana, CJK ideographs and Hangul) in a regular expression character class.
+CJK_RANGES = "\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af"
+
+# CJK characters, runs of letters / digits, and any other non-space character.
+_PIECE_PATTERN = re.compile(f"[{CJK_RANGES}]|[^\\W{CJK_RANGES}]+|[^\\w\\s]")
+_CJK_CHAR = re.compile(f"[{CJK_RANGES}]")
+
+_counters: Dict[str, Callable[[str], int]] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text without a tokenizer.
+
+    ASCII words count as one token per 4 characters (rounded up), CJK characters and ASCII punctuations as one
+    token each, and other words and symbols (e.g., Cyrillic, accented or Arabic words, emoji) as one token per
+    2 bytes of UTF-8 (rounded up). This is usually above what OpenAI tokenizers give for English and other
+    alphabetic scripts, but it is not a bound: rare words and CJK characters can take more tokens.
+    The only strict bound is one token per UTF-8 byte.
+    """
+    count = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        if piece.isascii():
+            count += math.ceil(len(piece) / 4) if piece[0].isalnum() else 1
+        elif _CJK_CHAR.match(piece):
+            count += 1
+        else:
+            count += math.ceil(len(piece.encode("utf-8")) / 2)
+    return count
+
+
+def get_token_counter(model: str = "gpt-3.5-turbo") -> Callable[[str], int]:
+    """Get a function counting the tokens of a text for a model.
+
+    The tokenizer of tiktoken is used if it's installed.
+    Otherwise, the number is estimated with :func:`estimate_tokens`.
+    """
+    if model not in _counters:
+        try:
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(model)
+            _counters[model] = lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            _logger.info("tiktoken not installed. Number of tokens is estimated.")
+            _counters[model] = estimate_tokens
+        except KeyError:
+            _logger.warning("Tokenizer of model %s is unknown. Number of tokens is estimated.", model)
+            _counters[model] = estimate_tokens
+    return _counters[model]
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Count the tokens of a text for a model. See :func:`get_token_counter`."""
+    return get_token_counter(model)(text)
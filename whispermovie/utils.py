@@ -1,5 +1,9 @@
 import logging
+import os
 import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
 
 
 def get_logger() -> logging.Logger:
@@ -21,3 +25,36 @@ def init_logger() -> None:
     handler.setLevel(level=logging.DEBUG)  # Print all the logs.
     handler.setFormatter(formatter)
     logger.addHandler(handler)
+
+
+def partial_path(path: Path) -> Path:
+    """
+    Path of the temporary file where ``path`` is written before it's complete.
+    """
+    return path.with_name(path.stem + ".partial" + path.suffix)
+
+
+@contextmanager
+def atomic_output(path: Path) -> Iterator[Path]:
+    """
+    Yield a temporary path to write to, which is moved to ``path`` only if the writing succeeds.
+    A reader (or a resumed run) never sees a half-written ``path``.
+    """
+    temporary_path = partial_path(path)
+    try:
+        yield temporary_path
+        with temporary_path.open("rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if temporary_path.exists():
+            temporary_path.unlink()
+        raise
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """
+    Write text (in UTF-8) to a file atomically.
+    """
+    with atomic_output(path) as temporary_path:
+        temporary_path.write_text(text, encoding="utf-8", errors="replace")